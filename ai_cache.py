@@ -0,0 +1,132 @@
+# -----------------------------
+# ai_cache.py
+# -----------------------------
+# Cache of /ask_ai answers keyed on (model, messages, temperature).
+#
+# Entries live in an in-memory LRU with a TTL. Setting AI_CACHE_DB adds a
+# SQLite tier that survives restarts; a disk hit is promoted back into
+# memory. Keys hash the payload after collapsing whitespace in message
+# text, so prompts that differ only in spacing share an entry.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "256"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "3600"))
+AI_CACHE_DB = os.getenv("AI_CACHE_DB") or None
+
+
+def cache_key(payload):
+    messages = [
+        {"role": m.get("role"), "content": " ".join(str(m.get("content", "")).split())}
+        for m in payload.get("messages", [])
+    ]
+    canonical = json.dumps(
+        {"model": payload.get("model"), "messages": messages, "temperature": payload.get("temperature")},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=AI_CACHE_SIZE, ttl=AI_CACHE_TTL, db_path=AI_CACHE_DB, table="ai_cache"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        # main.py also keeps replayed-mutation responses in a ResponseCache,
+        # in a table of their own.
+        self.table = table
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    # ---- lifecycle ----
+    def open(self):
+        if self.db_path:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            with self._db:
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._db.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+        return self
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # ---- lookups ----
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    f"SELECT value, expires_at FROM {self.table} WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), expires_at),
+                    )
+
+    def note_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def _remember(self, key, expires_at, value):
+        # Caller holds self._lock.
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "disk": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,167 @@
+# -----------------------------
+# bench_json.py
+# -----------------------------
+# The benchmarks behind trip_json.py, on generated trips (10 trips,
+# expenses split evenly between them). Times are the best of a few runs,
+# in milliseconds.
+#
+#   python bench_json.py [N ...]
+#       Encoding in process: a response body the old way (jsonable_encoder
+#       + JSONResponse), with dumps() and from RenderedBodies; saving the
+#       snapshot with json.dump(indent=2) vs dumps() compact and pretty;
+#       loading it with json.load vs orjson; and the file sizes.
+#
+#   python bench_json.py e2e [--code DIR] [N ...]
+#       GET /trip_data and GET /trip_data/0/expenses through TestClient,
+#       three requests each (the first renders, the rest may hit the
+#       cache). --code runs the app from another checkout, e.g.
+#           git worktree add /tmp/before <commit before trip_json.py>
+#           python bench_json.py e2e --code /tmp/before
+#       for the "before" column.
+#
+# N defaults to 10k, 100k and 1M expenses. Runs in a temporary directory.
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SIZES = [10_000, 100_000, 1_000_000]
+CATEGORIES = ["Food", "Transport", "Attractions", "Accommodation", "Shopping", "Other"]
+
+
+def fake_id():
+    return os.urandom(13).hex().upper()  # 26 characters, like a ULID
+
+
+def make_trips(n, trips=10):
+    return [
+        {
+            "id": fake_id(), "destination": f"Trip {t}", "start_date": "2024-01-01", "end_date": "2024-01-10",
+            "budget": 12000.0,
+            "expenses": [
+                {"id": fake_id(), "date": f"2024-01-{1 + i % 9:02d}", "category": CATEGORIES[i % 6],
+                 "amount": i * 1.25, "currency": "THB (฿)", "description": f"item {i}"}
+                for i in range(n // trips)
+            ],
+        }
+        for t in range(trips)
+    ]
+
+
+def best(fn, runs):
+    times = []
+    for _ in range(runs):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def ms(seconds, width=8):
+    return f"{seconds * 1000:{width}.1f}"
+
+
+def bench_encoding(sizes, workdir):
+    from fastapi.encoders import jsonable_encoder
+    from starlette.responses import JSONResponse
+
+    from trip_json import RenderedBodies, dumps, loads
+
+    path = os.path.join(workdir, "trip_data.json")
+    print(
+        f"{'expenses':>9} | {'resp before':>11} {'orjson':>8} {'cached':>8} | {'save indent':>11} {'compact':>8}"
+        f" {'pretty':>8} | {'load json':>9} {'orjson':>8} | {'MB before':>9} {'after':>8}"
+    )
+    for n in sizes:
+        trips = make_trips(n)
+        runs = 3 if n <= 100_000 else 1
+
+        def save_indented():
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(trips, f, indent=2)
+
+        def save(pretty=False):
+            with open(path, "wb") as f:
+                f.write(dumps(trips, pretty))
+
+        def load_json():
+            with open(path, "r", encoding="utf-8") as f:
+                json.load(f)
+
+        def load_orjson():
+            with open(path, "rb") as f:
+                loads(f.read())
+
+        before = best(lambda: JSONResponse(jsonable_encoder(trips)), runs)
+        after = best(lambda: dumps(trips), runs)
+        bodies = RenderedBodies()
+        bodies.put("trips", 1, dumps(trips))
+        cached = best(lambda: bodies.get("trips", 1), 5)
+        save_before = best(save_indented, runs)
+        size_before = os.path.getsize(path)
+        save_pretty = best(lambda: save(True), runs)
+        save_compact = best(save, runs)
+        size_after = os.path.getsize(path)
+        load_before = best(load_json, runs)
+        load_after = best(load_orjson, runs)
+        print(
+            f"{n:>9} | {ms(before, 11)} {ms(after)} {ms(cached)} | {ms(save_before, 11)} {ms(save_compact)}"
+            f" {ms(save_pretty)} | {ms(load_before, 9)} {ms(load_after)} | {size_before / 1e6:>9.1f}"
+            f" {size_after / 1e6:>8.1f}",
+            flush=True,
+        )
+        del trips, bodies
+        gc.collect()
+
+
+def bench_e2e(sizes, workdir, code):
+    # main.py reads trip_data.json from the working directory at import.
+    os.chdir(workdir)
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    for n in sizes:
+        with open("trip_data.json", "w", encoding="utf-8") as f:
+            json.dump(make_trips(n), f)
+        for name in os.listdir("."):
+            if name != "trip_data.json":
+                os.remove(name)
+        sys.modules.pop("main", None)
+        import main
+        from fastapi.testclient import TestClient
+
+        if not main.__file__.startswith(code):
+            sys.exit(f"main was imported from {main.__file__}, not {code}")
+
+        with TestClient(main.app) as client:
+            for url in ["/trip_data", "/trip_data/0/expenses"]:
+                times = []
+                for _ in range(3):
+                    start = time.perf_counter()
+                    res = client.get(url)
+                    times.append(time.perf_counter() - start)
+                res.raise_for_status()
+                print(
+                    f"{code} {n:>9} {url:<22} " + " ".join(ms(t) for t in times)
+                    + f"  ({len(res.content) / 1e6:.1f} MB)",
+                    flush=True,
+                )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    e2e = bool(args) and args[0] == "e2e"
+    if e2e:
+        args = args[1:]
+    code = HERE
+    if args[:1] == ["--code"]:
+        code, args = os.path.abspath(args[1]), args[2:]
+    sys.path.insert(0, code)
+    sizes = [int(a) for a in args] or SIZES
+    with tempfile.TemporaryDirectory() as workdir:
+        if e2e:
+            bench_e2e(sizes, workdir, code)
+        else:
+            bench_encoding(sizes, workdir)
@@ -0,0 +1,137 @@
+# -----------------------------
+# groq_client.py
+# -----------------------------
+# Shared, keep-alive HTTP client for the Groq chat completions API.
+#
+# main.py creates one GroqClient in the app lifespan. Connections to
+# api.groq.com are pooled and reused across /ask_ai calls, every phase
+# of a request has its own timeout, and a semaphore caps how many calls
+# are upstream at once (the rest wait in line and show up as `waiting`).
+import asyncio
+import json
+import os
+
+import httpx
+
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+
+MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "30"))
+MAX_IN_FLIGHT = int(os.getenv("GROQ_MAX_IN_FLIGHT", str(MAX_CONNECTIONS)))
+
+CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "60"))
+WRITE_TIMEOUT = float(os.getenv("GROQ_WRITE_TIMEOUT", "10"))
+POOL_TIMEOUT = float(os.getenv("GROQ_POOL_TIMEOUT", "10"))
+
+
+class GroqClient:
+    def __init__(self, api_key, url=GROQ_API_URL, max_in_flight=MAX_IN_FLIGHT, transport=None):
+        self.url = url
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self._transport = transport  # e.g. httpx.MockTransport in tests
+        self._client = None
+        self._semaphore = None
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def start(self):
+        self._client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=CONNECT_TIMEOUT,
+                read=READ_TIMEOUT,
+                write=WRITE_TIMEOUT,
+                pool=POOL_TIMEOUT,
+            ),
+            transport=self._transport,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _acquire(self):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.requests += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def chat(self, payload):
+        """
+        POST a chat completion and return the parsed JSON body.
+        Raises httpx.HTTPError on transport errors and non-2xx replies.
+        """
+        await self._acquire()
+        try:
+            response = await self._client.post(self.url, json=payload)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            self._release()
+
+    async def stream_chat(self, payload):
+        """
+        Stream a chat completion (`stream: true`) and yield each content
+        delta as it arrives. The in-flight slot is held until the stream
+        ends or the consumer stops iterating.
+        """
+        await self._acquire()
+        try:
+            async with self._client.stream("POST", self.url, json={**payload, "stream": True}) as response:
+                if response.is_error:
+                    await response.aread()  # so the error carries the body
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or []
+                    delta = choices[0].get("delta", {}).get("content") if choices else None
+                    if delta:
+                        yield delta
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            self._release()
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "max_in_flight": self.max_in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
@@ -1,105 +1,789 @@
-from fastapi import FastAPI, HTTPException, Request
-from pydantic import BaseModel
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, List, Optional
+import anyio
+import asyncio
+import hashlib
 import json
+import math
 import os
+import re
+import tempfile
+import time
+import weakref
 import httpx
 
-app = FastAPI()
+from ai_cache import ResponseCache, cache_key
+from groq_client import GroqClient
+from trip_aio import AsyncStore
+from trip_alerts import AlertHub, BudgetMonitor
+from trip_changes import ChangeFeed
+from trip_analytics import ExpenseColumns
+from trip_currency import FxTable, to_iso
+from single_flight import SingleFlight
+from trip_prompt import build_trip_prompt
+from trip_ids import with_id
+from trip_export import MEDIA_TYPES, export_stream
+from trip_import import PartialImport, UnreadableFile, import_expenses
+from trip_json import RenderedBodies, dumps
+from trip_store import create_store, TripNotFound, ExpenseNotFound, DuplicateId
+from trip_summary import TripSummaries, DEFAULT_CURRENCY, summary_json
+from trip_versions import TripVersions
 
 # Load API key from environment
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 if not GROQ_API_KEY:
     raise Exception("Set the GROQ_API_KEY environment variable")
 
-# Correct Groq API endpoint (OpenAI-compatible)
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-
 DATA_FILE = "trip_data.json"
+MAX_PAGE_SIZE = 1000
+# Longest a GET /changes long-poll may hold its request open.
+CHANGES_MAX_WAIT = 60
+# Uploads above this size spill from memory to a temp file while importing.
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+# Responses to mutations sent with an Idempotency-Key (e.g. by the pages'
+# offline outbox) are kept this long, so a replayed request is answered
+# from here instead of being applied twice.
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "idempotency.db")
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(30 * 24 * 3600)))
+# Worker threads for the remaining sync work (anyio's default is 40); store
+# calls have their own pool, sized by STORE_IO_THREADS (trip_aio.py).
+API_THREADPOOL_SIZE = int(os.getenv("API_THREADPOOL_SIZE", "40"))
+
+store = create_store(DATA_FILE)
+# Handlers await the store through this; its calls run on a bounded pool.
+store_io = AsyncStore(store)
+# OpenAI-compatible endpoint; GROQ_API_URL can point at a local mock server.
+groq = GroqClient(GROQ_API_KEY)
+ai_cache = ResponseCache()
+# Concurrent identical prompts share one upstream call (keyed like the cache).
+ai_flights = SingleFlight()
+replays = ResponseCache(max_entries=1024, ttl=IDEMPOTENCY_TTL, db_path=IDEMPOTENCY_DB, table="idempotency")
+replay_locks = weakref.WeakValueDictionary()  # key -> asyncio.Lock while in use
+# Running per-trip totals, updated by the store on every mutation.
+summaries = TripSummaries()
+# Collection / per-trip change counters, served as ETag and Last-Modified.
+versions = TripVersions()
+# Encoded bodies of unchanged collections, keyed on those versions.
+rendered = RenderedBodies()
+# Sequence-numbered log of recent mutations, served as deltas by /changes.
+changes = ChangeFeed()
+# Every expense as NumPy columns, for cross-trip group-by/top-N queries.
+analytics = ExpenseColumns()
+# Date-keyed FX rates (FX_RATES_FILE), re-read when the file changes.
+fx_rates = FxTable()
+# Running per-trip budget totals; threshold alerts fan out through the hub.
+alerts = AlertHub()
+budgets = BudgetMonitor(fx_rates, alerts.publish)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+    store_io.start()
+    await store_io.open()
+    store.subscribe(versions)
+    changes.bind(asyncio.get_running_loop())
+    store.subscribe(changes)
+    store.subscribe(summaries)
+    store.subscribe(analytics)
+    alerts.bind(asyncio.get_running_loop())
+    store.subscribe(budgets)
+    await groq.start()
+    ai_cache.open()
+    replays.open()
+    yield
+    replays.close()
+    ai_cache.close()
+    await groq.aclose()
+    await store_io.close()
+    store_io.shutdown()
+
+class TripJSONResponse(ORJSONResponse):
+    """
+    JSON via trip_json (orjson). Bytes are taken as an encoded body and
+    sent as they are.
+    """
+
+    def render(self, content):
+        return content if isinstance(content, bytes) else dumps(content)
+
+app = FastAPI(lifespan=lifespan, default_response_class=TripJSONResponse)
+
+# The JSON mutations a client may retry: trips and single expenses, by
+# index or id, and batch deletes. Bulk/file imports stream their request
+# and /ask_ai/stream its response, so those are left alone.
+IDEMPOTENT_PATHS = re.compile(
+    r"/trip_data(/[^/]+(/expense(/[^/]+)?|/expenses:delete)?)?"
+    r"|/trips/[^/]+(/expenses(/[^/]+|:delete)?)?"
+)
+
+@app.middleware("http")
+async def apply_once(request: Request, call_next):
+    """
+    A mutation sent with an Idempotency-Key header is applied once: later
+    requests with the same key (and method and path) get the first
+    response back, marked "Idempotent-Replayed: true". Reusing a key with
+    a different body is a client error (422). Server errors are not kept,
+    so those requests can be retried for real.
+    """
+    key = request.headers.get("idempotency-key")
+    if (
+        not key
+        or request.method not in ("POST", "PUT", "PATCH", "DELETE")
+        or not IDEMPOTENT_PATHS.fullmatch(request.url.path)
+    ):
+        return await call_next(request)
+    replay_key = f"{request.method} {request.url.path} {key}"
+    body_hash = hashlib.sha256(await request.body()).hexdigest()
+    lock = replay_locks.setdefault(replay_key, asyncio.Lock())
+    async with lock:  # a duplicate arriving mid-request waits for the first
+        stored = await run_in_threadpool(replays.get, replay_key)
+        if stored is not None:
+            if stored.get("body_hash", body_hash) != body_hash:
+                return TripJSONResponse(
+                    {"detail": "Idempotency-Key was already used with a different request body"},
+                    status_code=422,
+                )
+            return Response(
+                stored["body"], status_code=stored["status"], media_type=stored["media_type"],
+                headers={"Idempotent-Replayed": "true"},
+            )
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        media_type = response.headers.get("content-type")
+        if response.status_code < 500:
+            await run_in_threadpool(replays.put, replay_key, {
+                "status": response.status_code, "body": body.decode("utf-8"),
+                "media_type": media_type, "body_hash": body_hash,
+            })
+        return Response(body, status_code=response.status_code, headers=dict(response.headers))
 
 # -----------------------------
 # Models
 # -----------------------------
 class Expense(BaseModel):
+    id: Optional[str] = None
     date: str
     category: str
     amount: float
+    currency: Optional[str] = DEFAULT_CURRENCY
     description: Optional[str] = ""
 
+class TripUpdate(BaseModel):
+    destination: Optional[str] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    budget: Optional[float] = None
+    base_currency: Optional[str] = None
+    category_budgets: Optional[Dict[str, float]] = None
+
+class ExpenseIds(BaseModel):
+    ids: List[str]
+
 class TripData(BaseModel):
+    id: Optional[str] = None
     destination: str
     start_date: str
     end_date: str
     expenses: List[Expense] = []
+    budget: Optional[float] = None
+    base_currency: Optional[str] = None
+    category_budgets: Optional[Dict[str, float]] = None
+
+class AskAI(BaseModel):
+    question: Optional[str] = None
+    trip_index: Optional[int] = None
+    extra: Optional[str] = ""
 
 # -----------------------------
 # Helpers
 # -----------------------------
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return []
+def render_json(load, *args):
+    return dumps(load(*args))
+
+async def rendered_body(key, version, load, *args):
+    """
+    load(*args) encoded as JSON, once per `version` of `key`. The version
+    is read before the data, so a body never claims to be newer than it
+    is. Loading and encoding run on the store I/O pool.
+    """
+    body = rendered.get(key, version)
+    if body is None:
+        body = await store_io.run(render_json, load, *args)
+        rendered.put(key, version, body)
+    return body
+
+def send_json(content, response: Response = None):
+    """
+    Return `content` (or an encoded body) as a response of its own: this
+    skips FastAPI's jsonable_encoder pass over every trip and expense.
+    Headers already set on `response` (ETag, X-Next-Cursor) are kept.
+    """
+    return TripJSONResponse(content, headers=None if response is None else dict(response.headers))
+
+def last_modified(modified):
+    """
+    The Last-Modified second to advertise for a change at `modified`:
+    rounded up, so a later write in the same second still counts as a
+    modification, but never past the current second (while that second
+    runs, the previous one is sent and a revalidation just gets a 200).
+    """
+    return min(math.ceil(modified), int(time.time()))
+
+def is_fresh(request: Request, etag, modified):
+    """
+    True if the client's copy is current. If-None-Match, when sent,
+    decides alone (weak comparison against `etag`); otherwise
+    If-Modified-Since must not be older than `modified`, rounded up to a
+    whole second.
+    """
+    match = request.headers.get("if-none-match")
+    if match is not None:
+        tags = [t.strip().removeprefix("W/") for t in match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    since = request.headers.get("if-modified-since")
+    if since is None:
+        return False
     try:
-        with open(DATA_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return []
+        return math.ceil(modified) <= parsedate_to_datetime(since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+async def revalidate(request: Request, response: Response, trip_index=None):
+    """
+    Set ETag / Last-Modified for the trip list, or for one trip, on
+    `response`. Returns a bodiless 304 response when the client's copy is
+    still current, else None (also for a missing trip: the caller 404s).
+    """
+    await store_io.refresh()  # notice edits to trip_data.json first
+    stamp = versions.collection() if trip_index is None else versions.trip(trip_index)
+    if stamp is None:
+        return None
+    version, modified = stamp
+    headers = {
+        "ETag": versions.etag(version),
+        "Last-Modified": formatdate(last_modified(modified), usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if is_fresh(request, headers["ETag"], modified):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
 
-def save_data(data):
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+def project_trip(trip_index, trip, fields):
+    item = {"trip_index": trip_index}
+    if fields is None:
+        item.update(trip)
+    else:
+        item.update((f, trip[f]) for f in fields if f in trip)
+    return item
 
 # -----------------------------
 # Trip Endpoints
 # -----------------------------
 @app.get("/trip_data")
-def get_trip_data():
-    return load_data()
+async def get_trip_data(
+    request: Request,
+    response: Response,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    destination: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    category: Optional[str] = None,
+):
+    """
+    Without parameters, every trip exactly as stored (legacy shape).
+
+    With any parameter, each item also carries its "trip_index", and:
+      cursor/limit  page through trips; the next cursor is returned in the
+                    X-Next-Cursor header (absent on the last page)
+      fields        comma-separated keys to keep, e.g. destination,start_date
+      destination   case-insensitive substring match
+      date_from/to  trips whose dates overlap the range
+      category      trips with at least one expense in that category
+
+    Responses carry an ETag for the collection version; send it back as
+    If-None-Match to get 304 Not Modified while no trip has changed.
+    """
+    cached = await revalidate(request, response)
+    if cached is not None:
+        return cached
+    params = (cursor, limit, fields, destination, date_from, date_to, category)
+    if all(p is None for p in params):
+        version, _ = versions.collection()
+        return send_json(await rendered_body("trips", version, store.list_trips), response)
+
+    wanted = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    page, next_cursor = await store_io.page_trips(
+        cursor=cursor or 0,
+        limit=limit,
+        with_expenses=wanted is None or "expenses" in wanted,
+        destination=destination,
+        date_from=date_from,
+        date_to=date_to,
+        category=category,
+    )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return send_json([project_trip(i, trip, wanted) for i, trip in page], response)
+
+@app.get("/trip_data/{trip_index}/expenses")
+async def get_expenses(
+    request: Request,
+    response: Response,
+    trip_index: int,
+    category: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+):
+    cached = await revalidate(request, response, trip_index)
+    if cached is not None:
+        return cached
+    stamp = versions.trip(trip_index)
+    try:
+        if stamp is not None and all(p is None for p in (category, date_from, date_to, limit)) and not offset:
+            body = await rendered_body(("expenses", trip_index), stamp[0], store.query_expenses, trip_index)
+            return send_json(body, response)
+        return send_json(await store_io.query_expenses(
+            trip_index, category=category, date_from=date_from, date_to=date_to, limit=limit, offset=offset,
+        ), response)
+    except TripNotFound:
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+EXPORT_FORMAT = Query("csv", alias="format", pattern="^(csv|xlsx|parquet)$")
+
+async def export_response(fmt, trip_index, filename):
+    """
+    Stream an export with chunked transfer encoding; the generator is
+    advanced on the store I/O pool, so encoding never blocks the event loop.
+    """
+    try:
+        body = await store_io.run(export_stream, store, fmt, trip_index)
+    except TripNotFound:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    except ModuleNotFoundError as e:
+        raise HTTPException(status_code=501, detail=f"{e.name} is not installed on the server")
+    return StreamingResponse(
+        store_io.iterate(body),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+@app.get("/trip_data/export")
+async def export_all(fmt: str = EXPORT_FORMAT):
+    return await export_response(fmt, None, "trip_expenses")
+
+@app.get("/trip_data/{trip_index}/export")
+async def export_trip(trip_index: int, fmt: str = EXPORT_FORMAT):
+    return await export_response(fmt, trip_index, f"trip_{trip_index}_expenses")
+
+@app.get("/trip_data/versions")
+async def get_versions():
+    """
+    Current version tags of the trip list and of each trip (the ETag
+    values without W/ and quotes), for clients that cache per version.
+    """
+    await store_io.refresh()
+    return versions.snapshot()
+
+@app.get("/trip_data/summary")
+async def get_all_summaries(request: Request, response: Response):
+    cached = await revalidate(request, response)
+    if cached is not None:
+        return cached
+    return [summary_json(i, s) for i, s in enumerate(summaries.all())]
+
+@app.get("/trip_data/{trip_index}/summary")
+async def get_summary(request: Request, response: Response, trip_index: int):
+    cached = await revalidate(request, response, trip_index)
+    if cached is not None:
+        return cached
+    summary = summaries.get(trip_index)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return summary_json(trip_index, summary)
+
+async def patch_trip(trip_index, update: TripUpdate):
+    try:
+        trip = await store_io.update_trip(trip_index, update.dict(exclude_unset=True))
+    except TripNotFound:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return {"message": "Trip updated", "trip": trip}
+
+@app.patch("/trip_data/{trip_index}")
+async def update_trip(trip_index: int, update: TripUpdate):
+    """
+    Change only the fields sent, e.g. {"budget": 15000}.
+    """
+    return await patch_trip(trip_index, update)
 
 @app.post("/trip_data")
-def add_trip(trip: TripData):
-    data = load_data()
-    data.append(trip.dict())
-    save_data(data)
-    return {"message": "Trip added", "trip_index": len(data) - 1}
+async def add_trip(trip: TripData):
+    # Leave out unset optional fields rather than storing them as nulls.
+    record = with_id(trip.dict(exclude_none=True))
+    try:
+        trip_index = await store_io.add_trip(record)
+    except DuplicateId as e:
+        raise HTTPException(status_code=409, detail=f"Duplicate id: {e}")
+    return {"message": "Trip added", "trip_index": trip_index, "trip_id": record["id"]}
+
+async def create_expense(trip_index, expense):
+    try:
+        expense_id = await store_io.add_expense(trip_index, expense.dict())
+    except TripNotFound:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    except DuplicateId as e:
+        raise HTTPException(status_code=409, detail=f"Duplicate id: {e}")
+    return {"message": "Expense added", "expense_id": expense_id}
 
 @app.post("/trip_data/{trip_index}/expense")
-def add_expense(trip_index: int, expense: Expense):
-    data = load_data()
-    if trip_index < 0 or trip_index >= len(data):
+async def add_expense(trip_index: int, expense: Expense):
+    return await create_expense(trip_index, expense)
+
+async def read_bulk_rows(request: Request):
+    """
+    Yield the rows of a bulk upload: the items of a JSON array, or with an
+    NDJSON Content-Type, one raw line per row, parsed as the body arrives.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        pending = b""
+        async for chunk in request.stream():
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if pending.strip():
+            yield pending
+        return
+    try:
+        rows = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    for row in rows:
+        yield row
+
+async def ingest_expenses(trip_index, request: Request, skip_invalid):
+    """
+    Validate every row against Expense, then store the valid ones with one
+    write. Unless `skip_invalid`, any bad row rejects the whole batch.
+    """
+    expenses, errors = [], []
+    row_number = 0
+    async for row in read_bulk_rows(request):
+        try:
+            if isinstance(row, bytes):
+                row = json.loads(row)
+            expenses.append(Expense.parse_obj(row).dict())
+        except ValidationError as e:
+            errors.append({"row": row_number, "errors": jsonable_encoder(e.errors())})
+        except ValueError as e:
+            errors.append({"row": row_number, "errors": [{"msg": f"Invalid JSON: {e}"}]})
+        row_number += 1
+
+    if errors and not skip_invalid:
+        raise HTTPException(status_code=422, detail={"message": "No expenses added", "errors": errors})
+    try:
+        ids = await store_io.add_expenses(trip_index, expenses) if expenses else []
+    except TripNotFound:
         raise HTTPException(status_code=404, detail="Trip not found")
-    data[trip_index]["expenses"].append(expense.dict())
-    save_data(data)
-    return {"message": "Expense added"}
+    except DuplicateId as e:
+        raise HTTPException(status_code=409, detail=f"Duplicate id: {e}")
+    return {"message": "Expenses added", "added": len(ids), "expense_ids": ids, "errors": errors}
+
+@app.post("/trip_data/{trip_index}/expenses:bulk")
+async def add_expenses_bulk(trip_index: int, request: Request, skip_invalid: bool = False):
+    """
+    Body: a JSON array of expenses, or NDJSON (Content-Type:
+    application/x-ndjson). Errors are reported per row (0-based).
+    """
+    return await ingest_expenses(trip_index, request, skip_invalid)
+
+async def ingest_file(trip_index, request: Request, fmt):
+    # XLSX is a zip archive and needs a seekable file, so the body is
+    # spooled first; the rows are then streamed into the store in batches.
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as f:
+        async for chunk in request.stream():
+            f.write(chunk)
+        f.seek(0)
+        try:
+            result = await store_io.run(import_expenses, store, trip_index, f, fmt)
+        except TripNotFound:
+            raise HTTPException(status_code=404, detail="Trip not found")
+        except UnreadableFile as e:
+            raise HTTPException(status_code=400, detail=f"Cannot import file: {e}")
+        except PartialImport as e:
+            # Earlier batches are stored: say how many instead of "nothing".
+            cause = e.__cause__
+            raise HTTPException(
+                status_code=400 if isinstance(cause, UnreadableFile) else 500,
+                detail={
+                    "message": f"Import stopped after {e.added} expenses were added: {cause}",
+                    "added": e.added, "skipped": e.skipped, "errors": e.errors,
+                },
+            )
+    return dict(result, message="Expenses imported")
+
+@app.post("/trip_data/{trip_index}/import")
+async def import_file(
+    trip_index: int, request: Request, fmt: Optional[str] = Query(None, alias="format", pattern="^(csv|xlsx)$"),
+):
+    """
+    Body: the raw .xlsx or .csv file (format sniffed unless ?format= is
+    given), with date/category/amount columns and optional currency and
+    description. Bad rows are skipped and reported.
+    """
+    return await ingest_file(trip_index, request, fmt)
 
 @app.delete("/trip_data/{trip_index}/expense/{expense_index}")
-def delete_expense(trip_index: int, expense_index: int):
-    data = load_data()
-    if trip_index < 0 or trip_index >= len(data):
+async def delete_expense(trip_index: int, expense_index: int):
+    try:
+        deleted = await store_io.delete_expense(trip_index, expense_index)
+    except TripNotFound:
         raise HTTPException(status_code=404, detail="Trip not found")
-    if expense_index < 0 or expense_index >= len(data[trip_index]["expenses"]):
+    except ExpenseNotFound:
         raise HTTPException(status_code=404, detail="Expense not found")
-    
-    deleted = data[trip_index]["expenses"].pop(expense_index)
-    save_data(data)
     return {"message": "Expense deleted", "deleted": deleted}
 
+def delete_expenses_by_id(trip_index, expense_ids):
+    deleted, missing = [], []
+    for expense_id in expense_ids:
+        try:
+            deleted.append(store.delete_expense_by_id(trip_index, expense_id))
+        except ExpenseNotFound:
+            missing.append(expense_id)
+    return deleted, missing
+
+async def remove_expenses(trip_index, body: ExpenseIds):
+    if versions.trip(trip_index) is None:  # also for an empty list
+        raise HTTPException(status_code=404, detail="Trip not found")
+    try:
+        deleted, missing = await store_io.run(delete_expenses_by_id, trip_index, body.ids)
+    except TripNotFound:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return {"message": "Expenses deleted", "deleted": deleted, "missing": missing}
+
+@app.post("/trip_data/{trip_index}/expenses:delete")
+async def delete_expenses(trip_index: int, body: ExpenseIds):
+    """
+    Body: {"ids": [...]}. Deletes every listed expense in one request;
+    ids that are already gone are reported under "missing".
+    """
+    return await remove_expenses(trip_index, body)
 
 # -----------------------------
-# AI Endpoint
+# Trip Endpoints by id
 # -----------------------------
-@app.post("/ask_ai")
-async def ask_ai(request: Request):
-    json_body = await request.json()
-    question = json_body.get("question")
-    if not question:
-        raise HTTPException(status_code=400, detail="Missing 'question' in request body")
+# Same data as /trip_data, addressed by the ULIDs the server assigns, which
+# stay valid across deletes (expense positions shift; ids do not).
+async def trip_index_of(trip_id):
+    try:
+        return await store_io.trip_index_of(trip_id)
+    except TripNotFound:
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+@app.get("/trips/{trip_id}")
+async def get_trip(request: Request, response: Response, trip_id: str):
+    trip_index = await trip_index_of(trip_id)
+    cached = await revalidate(request, response, trip_index)
+    if cached is not None:
+        return cached
+    try:
+        trip = await store_io.get_trip(trip_index)
+    except TripNotFound:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return send_json(dict(trip, trip_index=trip_index), response)
+
+@app.patch("/trips/{trip_id}")
+async def update_trip_by_id(trip_id: str, update: TripUpdate):
+    return await patch_trip(await trip_index_of(trip_id), update)
+
+@app.post("/trips/{trip_id}/expenses")
+async def add_expense_by_trip_id(trip_id: str, expense: Expense):
+    return await create_expense(await trip_index_of(trip_id), expense)
+
+@app.post("/trips/{trip_id}/expenses:bulk")
+async def add_expenses_bulk_by_trip_id(trip_id: str, request: Request, skip_invalid: bool = False):
+    return await ingest_expenses(await trip_index_of(trip_id), request, skip_invalid)
+
+@app.post("/trips/{trip_id}/import")
+async def import_file_by_trip_id(
+    trip_id: str, request: Request, fmt: Optional[str] = Query(None, alias="format", pattern="^(csv|xlsx)$"),
+):
+    return await ingest_file(await trip_index_of(trip_id), request, fmt)
+
+@app.get("/trips/{trip_id}/export")
+async def export_trip_by_id(trip_id: str, fmt: str = EXPORT_FORMAT):
+    return await export_response(fmt, await trip_index_of(trip_id), f"trip_{trip_id}_expenses")
+
+@app.get("/trips/{trip_id}/expenses/{expense_id}")
+async def get_expense(trip_id: str, expense_id: str):
+    trip_index = await trip_index_of(trip_id)
+    try:
+        return await store_io.get_expense(trip_index, expense_id)
+    except ExpenseNotFound:
+        raise HTTPException(status_code=404, detail="Expense not found")
+
+@app.put("/trips/{trip_id}/expenses/{expense_id}")
+async def update_expense(trip_id: str, expense_id: str, expense: Expense):
+    trip_index = await trip_index_of(trip_id)
+    try:
+        updated = await store_io.update_expense(trip_index, expense_id, expense.dict())
+    except ExpenseNotFound:
+        raise HTTPException(status_code=404, detail="Expense not found")
+    return {"message": "Expense updated", "expense": updated}
+
+@app.delete("/trips/{trip_id}/expenses/{expense_id}")
+async def delete_expense_by_id(trip_id: str, expense_id: str):
+    trip_index = await trip_index_of(trip_id)
+    try:
+        deleted = await store_io.delete_expense_by_id(trip_index, expense_id)
+    except ExpenseNotFound:
+        raise HTTPException(status_code=404, detail="Expense not found")
+    return {"message": "Expense deleted", "deleted": deleted}
+
+@app.post("/trips/{trip_id}/expenses:delete")
+async def delete_expenses_by_trip_id(trip_id: str, body: ExpenseIds):
+    return await remove_expenses(await trip_index_of(trip_id), body)
+
+
+# -----------------------------
+# Change Feed
+# -----------------------------
+@app.get("/changes")
+async def get_changes(
+    since: int = 0,
+    epoch: Optional[str] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    wait: float = Query(0, ge=0, le=CHANGES_MAX_WAIT),
+):
+    """
+    Mutations after sequence number `since`, oldest first, so a client can
+    keep its copy current without fetching every trip again. Pass the
+    "epoch" and "seq" of the previous response back as `epoch` and
+    `since`; while "seq" < "latest", ask again for the rest. With
+    "reset": true, fetch /trip_data, then continue from "seq".
+    With `wait`, long-poll: hold the request up to that many seconds
+    until there is a change.
+    """
+    await store_io.refresh()  # notice edits to trip_data.json first
+    batch = changes.since(since, limit=limit, epoch=epoch)
+    if wait and not batch["reset"] and not batch["changes"]:
+        await changes.wait(since, wait)
+        batch = changes.since(since, limit=limit, epoch=epoch)
+    return send_json(batch)
+
+@app.websocket("/changes/ws")
+async def changes_socket(websocket: WebSocket, since: int = 0, epoch: Optional[str] = None):
+    """
+    The same batches as GET /changes, pushed as they happen.
+    """
+    await websocket.accept()
+    try:
+        async for batch in changes.follow(since, epoch=epoch, limit=MAX_PAGE_SIZE):
+            await websocket.send_json(batch)
+    except WebSocketDisconnect:
+        pass
+
+
+# -----------------------------
+# Analytics
+# -----------------------------
+@app.get("/analytics/spend")
+async def get_spend(
+    by: str = Query("category", pattern="^(category|currency|day)$"),
+    trip_index: Optional[int] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    currency: Optional[str] = None,
+):
+    """
+    Totals per category, currency or day (each split by currency) over all
+    trips, or one trip, optionally within a date range. With `currency`
+    (e.g. THB), amounts are converted at each expense's date and summed
+    in that currency; expenses without a known rate are left out.
+    """
+    to = to_iso(currency) if currency else None
+    return await run_in_threadpool(
+        analytics.group_sum, by, trip_index=trip_index, date_from=date_from, date_to=date_to, fx=fx_rates, to=to,
+    )
+
+@app.get("/analytics/top")
+async def get_top(
+    n: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    by: str = Query("category", pattern="^(category|day)$"),
+    trip_index: Optional[int] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    currency: Optional[str] = None,
+):
+    to = to_iso(currency) if currency else None
+    return await run_in_threadpool(
+        analytics.top, n, by, trip_index=trip_index, date_from=date_from, date_to=date_to, fx=fx_rates, to=to,
+    )
+
+@app.get("/trip_data/{trip_index}/budget")
+async def get_budget(trip_index: int):
+    """
+    Budget vs. spend in the trip's base currency ("base_currency", THB by
+    default), from the monitor's running totals. Currencies without FX
+    rates are listed under "unconverted" instead of being guessed.
+    """
+    status = budgets.status(trip_index)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return status
 
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json",
-    }
 
-    payload = {
+# -----------------------------
+# Budget Alerts
+# -----------------------------
+@app.get("/alerts")
+async def get_alerts(since: int = 0):
+    return alerts.recent(since)
+
+@app.get("/alerts/stream")
+async def stream_alerts(since: int = 0):
+    """
+    Budget alerts as Server-Sent Events, starting with any kept alert
+    newer than `since`.
+    """
+    async def events():
+        async for alert in alerts.subscribe(since):
+            yield f"id: {alert['id']}\n" + sse(alert)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/alerts/ws")
+async def alerts_socket(websocket: WebSocket, since: int = 0):
+    await websocket.accept()
+    try:
+        async for alert in alerts.subscribe(since):
+            await websocket.send_json(alert)
+    except WebSocketDisconnect:
+        pass
+
+
+# -----------------------------
+# AI Endpoint
+# -----------------------------
+def build_ai_payload(question):
+    return {
         "model": "llama-3.3-70b-versatile",  # ✅ pick one from your list
         "messages": [
             {"role": "system", "content": "You are a helpful trip planning assistant."},
@@ -109,21 +793,143 @@ async def ask_ai(request: Request):
         "max_completion_tokens": 512,  # <= must not exceed model limit
     }
 
+async def read_ai_payload(request: Request):
+    """
+    Body is either {"question": "..."} or {"trip_index": i, "extra": "..."};
+    the latter builds a compact prompt from the trip's spending summary.
+    """
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(GROQ_API_URL, headers=headers, json=payload)
-            response.raise_for_status()
-    except httpx.HTTPError as e:
-        return {
-            "error": str(e),
-            "status": getattr(e.response, "status_code", None),
-            "body": getattr(e.response, "text", ""),
-        }
+        body = AskAI.parse_obj(await request.json())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Request body is not valid JSON")
+    if body.trip_index is not None:
+        try:
+            trip = await store_io.get_trip(body.trip_index)
+        except TripNotFound:
+            raise HTTPException(status_code=404, detail="Trip not found")
+        prompt = build_trip_prompt(
+            trip, body.extra, summary=summaries.get(body.trip_index), status=budgets.status(body.trip_index),
+        )
+        return build_ai_payload(prompt)
+    question = body.question
+    if not question:
+        raise HTTPException(status_code=400, detail="Missing 'question' in request body")
+    return build_ai_payload(question)
 
-    result = response.json()
+async def lookup_cached_answer(request: Request, key):
+    """
+    Return (cached answer or None, X-Cache header value).
+    "Cache-Control: no-cache" skips the lookup but still refreshes the entry.
+    """
+    if "no-cache" in request.headers.get("cache-control", "").lower():
+        ai_cache.note_bypass()
+        return None, "BYPASS"
+    # With AI_CACHE_DB set, a miss in memory reads SQLite.
+    cached = await run_in_threadpool(ai_cache.get, key)
+    return cached, "HIT" if cached is not None else "MISS"
+
+async def fetch_answer(payload, key):
+    """
+    One upstream completion, cached when it has an answer (None if not).
+    Runs as the single-flight leader's task, so callers coalesced onto it
+    do not store the answer again.
+    """
+    result = await groq.chat(payload)
     try:
         answer = result["choices"][0]["message"]["content"].strip()
     except (KeyError, IndexError):
-        answer = "No valid response from Groq"
+        return None
+    await run_in_threadpool(ai_cache.put, key, answer)
+    return answer
+
+async def stream_answer(payload, key):
+    """
+    Groq's deltas for `payload`; the whole answer is cached at the end.
+    Pumped once per single flight, like fetch_answer.
+    """
+    parts = []
+    async for delta in groq.stream_chat(payload):
+        parts.append(delta)
+        yield delta
+    answer = "".join(parts).strip()
+    if answer:
+        await run_in_threadpool(ai_cache.put, key, answer)
 
-    return {"answer": answer}
\ No newline at end of file
+def upstream_error(e: httpx.HTTPError):
+    # Timeouts and connection errors carry no response.
+    upstream = getattr(e, "response", None)
+    return {
+        "error": str(e),
+        "status": getattr(upstream, "status_code", None),
+        "body": getattr(upstream, "text", ""),
+    }
+
+@app.post("/ask_ai")
+async def ask_ai(request: Request, response: Response):
+    payload = await read_ai_payload(request)
+    key = cache_key(payload)
+    cached, cache_status = await lookup_cached_answer(request, key)
+    response.headers["X-Cache"] = cache_status
+    if cached is not None:
+        return {"answer": cached}
+
+    try:
+        answer = await ai_flights.do(key, lambda: fetch_answer(payload, key))
+    except httpx.HTTPError as e:
+        return upstream_error(e)
+    if answer is None:
+        return {"answer": "No valid response from Groq"}
+    return {"answer": answer}
+
+def sse(data):
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask_ai/stream")
+async def ask_ai_stream(request: Request):
+    """
+    Same as /ask_ai, but forwards Groq's tokens as Server-Sent Events:
+    `data: {"delta": "..."}` per chunk, `data: {"error": ...}` if the
+    upstream call fails, and `data: [DONE]` at the end.
+    """
+    payload = await read_ai_payload(request)
+    key = cache_key(payload)
+    cached, cache_status = await lookup_cached_answer(request, key)
+
+    async def events():
+        if cached is not None:
+            yield sse({"delta": cached})
+            yield "data: [DONE]\n\n"
+            return
+        try:
+            async for delta in ai_flights.stream(key, lambda: stream_answer(payload, key)):
+                yield sse({"delta": delta})
+        except httpx.HTTPError as e:
+            yield sse(upstream_error(e))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Cache": cache_status},
+    )
+
+
+# -----------------------------
+# Metrics
+# -----------------------------
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "store_io": store_io.stats(),
+        "versions": versions.stats(),
+        "rendered": rendered.stats(),
+        "changes": changes.stats(),
+        "groq": groq.stats(),
+        "ai_cache": ai_cache.stats(),
+        "ai_single_flight": ai_flights.stats(),
+        "idempotency": replays.stats(),
+        "analytics": analytics.stats(),
+        "alerts": alerts.stats(),
+    }
@@ -0,0 +1,61 @@
+# -----------------------------
+# mock_groq.py
+# -----------------------------
+# Minimal OpenAI-compatible chat completions server for exercising
+# /ask_ai without a real Groq key or network access.
+#
+#   uvicorn mock_groq:app --port 9000
+#   GROQ_API_KEY=test GROQ_API_URL=http://127.0.0.1:9000/openai/v1/chat/completions \
+#       uvicorn main:app --port 8000
+#
+# MOCK_GROQ_DELAY adds latency (seconds) to every completion, which makes
+# the in-flight cap and queue depth visible under load.
+import asyncio
+import json
+import os
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+MOCK_DELAY = float(os.getenv("MOCK_GROQ_DELAY", "0"))
+
+app = FastAPI()
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if MOCK_DELAY:
+        await asyncio.sleep(MOCK_DELAY)
+    question = body.get("messages", [{}])[-1].get("content", "")
+    answer = f"Mock itinerary for: {question[:200]}"
+    if body.get("stream"):
+        return StreamingResponse(_stream(body.get("model", "mock"), answer), media_type="text/event-stream")
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+async def _stream(model, answer):
+    for i, word in enumerate(answer.split(" ")):
+        chunk = {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(0.01)
+    yield "data: [DONE]\n\n"
@@ -0,0 +1,107 @@
+# -----------------------------
+# single_flight.py
+# -----------------------------
+# Request coalescing for identical in-flight AI prompts.
+#
+# The first caller for a key starts the upstream work as its own task;
+# callers arriving while it runs await the same task (or, for streams,
+# replay the chunks seen so far and then follow the live ones). The task
+# is shielded, so one client disconnecting does not cancel the others.
+import asyncio
+
+
+class _StreamFlight:
+    """
+    One upstream stream fanned out to any number of subscribers.
+    """
+
+    def __init__(self, source):
+        self.parts = []
+        self.error = None
+        self.done = False
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for part in source:
+                async with self._changed:
+                    self.parts.append(part)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    async def subscribe(self):
+        seen = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: seen < len(self.parts) or self.done)
+                new = self.parts[seen:]
+                seen = len(self.parts)
+                finished = self.done
+            for part in new:
+                yield part
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}    # key -> asyncio.Task
+        self._streams = {}  # key -> _StreamFlight
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, start):
+        """
+        Return the result of `await start()`, sharing one call among all
+        concurrent callers with the same key.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(start())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(self._calls, key, t))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def stream(self, key, start):
+        """
+        Yield the chunks of `start()` (an async iterator), sharing one
+        upstream stream among all concurrent callers with the same key.
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight(start())
+            self._streams[key] = flight
+            flight.task.add_done_callback(lambda t: self._forget(self._streams, key, flight))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        async for part in flight.subscribe():
+            yield part
+
+    @staticmethod
+    def _forget(registry, key, entry):
+        if registry.get(key) is entry:
+            del registry[key]
+        # Mark a failed call's exception as retrieved even if every waiter
+        # went away, so asyncio does not log it as unhandled.
+        task = entry if isinstance(entry, asyncio.Future) else entry.task
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
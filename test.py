@@ -1,11 +1,10 @@
 import streamlit as st
 import requests
-import json
-import os
 from datetime import date
-import pandas as pd
-import plotly.express as px
-from trip_utils import apply_fancy_theme, export_to_excel, export_to_csv
+from trip_client import error_detail, last_known_trips, load_expense_page, load_summary, load_trips, outbox, write
+from trip_ids import with_id
+from trip_summary import summarize_expenses, summary_json
+from trip_utils import apply_fancy_theme, fetch_budget_status, pick_page, select_expenses, show_budget_status, show_spending_summary, stream_ai_answer
 
 apply_fancy_theme()
 
@@ -13,34 +12,22 @@ FASTAPI_URL = "http://127.0.0.1:8000"
 DATA_FILE = "trip_data.json"
 
 # -------------------------
-# Helpers: load / save local
+# Offline writes
 # -------------------------
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except:
-            return []
-
-def save_data(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-# -------------------------
-# Local delete helpers
-# -------------------------
-def local_delete_expense(trip_index, expense_index):
-    trips = load_data()
-    if 0 <= trip_index < len(trips):
-        expenses = trips[trip_index].get("expenses", [])
-        if 0 <= expense_index < len(expenses):
-            removed = expenses.pop(expense_index)
-            trips[trip_index]["expenses"] = expenses
-            save_data(trips)
-            return removed
-    return None
+# Reads go through trip_client (a replica synced by deltas). Writes the
+# server cannot take are queued in the outbox and sent when it is back;
+# trip_data.json belongs to main.py and is only read here.
+def save(op, trip, body):
+    """
+    "sent" or "queued"; None (after showing why) if the server refused it.
+    """
+    res = write(FASTAPI_URL, op, trip, body)
+    if res is None:
+        return "queued"
+    if not res.ok:
+        st.error(f"The server rejected this change: {error_detail(res)}")
+        return None
+    return "sent"
 
 # -------------------------
 # Streamlit session state refresh
@@ -71,21 +58,22 @@ with st.sidebar.form("new_trip"):
             "expenses": [],
             "budget": budget
         }
-        try:
-            res = requests.post(f"{FASTAPI_URL}/trip_data", json=trip_data)
-            if res.ok:
-                st.sidebar.success("Trip added on server!")
-            else:
-                raise Exception("Server unreachable")
-        except:
-            trips_local = load_data()
-            trips_local.append(trip_data)
-            save_data(trips_local)
-            st.sidebar.success("Server unreachable — trip saved locally.")
+        saved = save("add_trip", None, with_id(trip_data))
+        if saved == "sent":
+            st.sidebar.success("Trip added on server!")
+        elif saved == "queued":
+            st.sidebar.success("Server unreachable — trip queued, it will sync automatically.")
         st.session_state.refresh = not st.session_state.refresh
 
 # --- Load trips ---
-trips = load_data()
+trips, versions = load_trips(FASTAPI_URL)
+if trips is None:
+    trips = outbox(FASTAPI_URL).overlay(last_known_trips(FASTAPI_URL, DATA_FILE))
+waiting = outbox(FASTAPI_URL).stats()
+if waiting["pending"]:
+    st.sidebar.info(f"{waiting['pending']} change(s) waiting to sync with the server.")
+if waiting["failed"]:
+    st.sidebar.warning(f"{waiting['failed']} queued change(s) were rejected by the server.")
 if trips:
     trip_index = st.selectbox(
         "Select a Trip",
@@ -93,16 +81,20 @@ if trips:
         format_func=lambda i: f"{i}. {trips[i]['destination']}"
     )
     selected_trip = trips[trip_index]
+    # Queued writes name the trip by id, which survives other trips' changes.
+    trip_ref = selected_trip.get("id", trip_index)
     st.subheader(f"✈️ {selected_trip['destination']} ({selected_trip['start_date']} → {selected_trip['end_date']})")
 
     # --- Trip Budget ---
     current_budget = selected_trip.get("budget", 12000.0)
     new_budget = st.number_input("Set Budget (THB)", value=current_budget, step=500.0, key="budget_input")
     if new_budget != current_budget:
-        trips[trip_index]["budget"] = new_budget
-        save_data(trips)
-        selected_trip["budget"] = new_budget
-        st.success(f"Budget updated to {new_budget:,.0f} THB")
+        if save("update_trip", trip_ref, {"budget": new_budget}):
+            selected_trip["budget"] = new_budget
+            st.success(f"Budget updated to {new_budget:,.0f} THB")
+    budget_status = fetch_budget_status(FASTAPI_URL, trip_index)
+    if budget_status is not None:
+        show_budget_status(budget_status)
 
     # --- Add Expense ---
     with st.form("add_expense"):
@@ -120,81 +112,44 @@ if trips:
                 "currency": currency,
                 "description": description
             }
-            try:
-                res = requests.post(f"{FASTAPI_URL}/trip_data/{trip_index}/expense", json=expense)
-                if not (res and res.ok):
-                    raise Exception("Server unreachable")
-            except:
-                trips[trip_index].setdefault("expenses", []).append(expense)
-                save_data(trips)
-            st.success("Expense added!")
-            st.session_state.refresh = not st.session_state.refresh
+            if save("add_expense", trip_ref, with_id(expense)):
+                st.success("Expense added!")
+                st.session_state.refresh = not st.session_state.refresh
 
     # --- Expenses Table & Delete ---
-    expenses = selected_trip.get("expenses", [])
-    if expenses:
+    # One page at a time, in a single widget.
+    if versions is not None:
+        summary = load_summary(FASTAPI_URL, trip_index, versions)
+        total = summary["count"] if summary else 0
+    else:
+        summary = summary_json(trip_index, summarize_expenses(selected_trip.get("expenses", [])))
+        total = len(selected_trip.get("expenses", []))
+    if total:
         st.write("💰 Expenses")
-        for i, e in enumerate(expenses):
-            col1, col2 = st.columns([8,1])
-            with col1:
-                st.write(f"{i+1}. {e.get('date','')} | {e.get('category','')} | "
-                          f"{e.get('amount',0.0)} {e.get('currency','THB (฿)')} | {e.get('description','')}")
-            with col2:
-                if st.button(f"Delete {i+1}", key=f"del_{i}"):
-                    try:
-                        res = requests.delete(f"{FASTAPI_URL}/trip_data/{trip_index}/expense/{i}")
-                        if not (res and res.ok):
-                            raise Exception("Server unreachable")
-                    except:
-                        local_delete_expense(trip_index, i)
-                    st.success(f"Expense {i+1} deleted")
-                    st.session_state.refresh = not st.session_state.refresh
-
-        # --- Total Expenses by Currency ---
-        totals = {}
-        for e in expenses:
-            curr = e.get("currency","THB (฿)")
-            totals[curr] = totals.get(curr,0) + e.get("amount",0.0)
-        for curr, amt in totals.items():
-            st.write(f"**Total Spent ({curr}):** {amt:.2f}")
-
-        # --- Visual Charts ---
-        df_exp = pd.DataFrame(expenses)
-        # Ensure columns exist
-        for col in ["category","amount","currency"]:
-            if col not in df_exp.columns:
-                df_exp[col] = "Unknown" if col!="amount" else 0.0
-        fig_cat = px.bar(
-            df_exp.groupby("category", as_index=False)["amount"].sum(),
-            x="category", y="amount", color="category", title="Total Expenses by Category"
-        )
-        st.plotly_chart(fig_cat, use_container_width=True)
-
-        fig_curr = px.pie(
-            df_exp.groupby("currency", as_index=False)["amount"].sum(),
-            names="currency", values="amount", title="Expenses by Currency"
-        )
-        fig_curr.update_traces(textinfo='label+percent', hoverinfo='label+value+percent')
-        st.plotly_chart(fig_curr, use_container_width=True)
+        offset, limit = pick_page(total, key=f"expense_page_{trip_index}")
+        if versions is not None:
+            rows = load_expense_page(FASTAPI_URL, trip_index, offset, limit) or []
+        else:
+            rows = selected_trip["expenses"][offset:offset + limit]
+        selected = select_expenses(rows, key=f"expenses_{trip_index}_{offset}_{st.session_state.refresh}")
+        if st.button(f"🗑️ Delete {len(selected)} selected", disabled=not selected):
+            ids = [rows[i].get("id") for i in selected]
+            if not all(ids):
+                # Rows from a file the server never loaded have no ids yet.
+                st.error("These expenses can only be deleted while the server is running.")
+            elif save("delete_expenses", trip_ref, {"ids": ids}):
+                st.session_state.refresh = not st.session_state.refresh
+                st.rerun()
+
+        # --- Totals & Charts (precomputed by the server) ---
+        show_spending_summary(summary)
     else:
         st.info("No expenses yet.")
 
-    # --- Export to Excel ---
-    if st.button("💾 Export Expenses to Excel"):
-        df_export = pd.DataFrame(expenses)
-        if not df_export.empty:
-            try:
-                import io
-                excel_buffer = io.BytesIO()
-                df_export.to_excel(excel_buffer, index=False, engine='openpyxl')
-                st.download_button(
-                    label="Download Excel",
-                    data=excel_buffer,
-                    file_name=f"{selected_trip['destination']}_expenses.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-            except ModuleNotFoundError:
-                st.error("openpyxl module not installed. Run `pip install openpyxl`")
+    # --- Export (streamed by the server, the page holds no file) ---
+    col_xlsx, col_csv = st.columns(2)
+    col_xlsx.link_button("💾 Export Expenses to Excel", f"{FASTAPI_URL}/trip_data/{trip_index}/export?format=xlsx")
+    col_csv.link_button("💾 Export Expenses to CSV", f"{FASTAPI_URL}/trip_data/{trip_index}/export?format=csv")
 
     # --- AI Itinerary ---
     extra_prompt = st.text_area(
@@ -202,16 +157,10 @@ if trips:
         placeholder="E.g., suggest vegetarian restaurants, budget under 1500 THB, focus on adventure activities..."
     )
     if st.button("🧠 Generate AI Itinerary"):
-        question = (
-            f"Plan a trip to {selected_trip['destination']} from {selected_trip['start_date']} "
-            f"to {selected_trip['end_date']}, considering these expenses: {selected_trip.get('expenses',[])}. "
-            f"{extra_prompt}"
-        )
+        # The server builds the prompt from the trip's spending summary.
         try:
-            r = requests.post(f"{FASTAPI_URL}/ask_ai", json={"question": question}, timeout=6)
-            if r.ok:
-                st.markdown(r.json().get("answer","No answer"))
-            else:
-                st.error("AI request failed (server).")
-        except:
+            st.write_stream(stream_ai_answer(FASTAPI_URL, trip_index, extra_prompt))
+        except requests.HTTPError:
+            st.error("AI request failed (server).")
+        except requests.RequestException:
             st.error("AI server unreachable.")
@@ -0,0 +1,78 @@
+# -----------------------------
+# trip_aio.py
+# -----------------------------
+# Async facade over the (blocking) trip stores.
+#
+# Store calls run on a dedicated, bounded thread pool of STORE_IO_THREADS
+# workers rather than on FastAPI's shared threadpool, so disk writes and
+# fsyncs neither block the event loop nor compete with other sync work
+# for threads. Any store method can be awaited through the facade:
+#   trip = await store_io.get_trip(trip_index)
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+STORE_IO_THREADS = int(os.getenv("STORE_IO_THREADS", "8"))
+
+_DONE = object()
+
+
+class AsyncStore:
+    def __init__(self, store, max_workers=STORE_IO_THREADS):
+        self.store = store
+        self.max_workers = max_workers
+        self._executor = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="trip-io")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Await fn(*args, **kwargs) on the store I/O pool.
+        """
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+
+    async def iterate(self, iterator):
+        """
+        Async iterator over a blocking one (e.g. an export that reads the
+        store as it goes), advanced on the store I/O pool.
+        """
+        while True:
+            item = await self.run(next, iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+    def stats(self):
+        # Calls beyond max_workers wait in the executor's queue.
+        return {
+            "threads": self.max_workers,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "calls": self.calls,
+        }
@@ -0,0 +1,270 @@
+# -----------------------------
+# trip_alerts.py
+# -----------------------------
+# Server-side budget monitor.
+#
+# BudgetMonitor is a store listener keeping, per trip, the running spend
+# in the trip's base currency (converted at each expense's date) plus
+# per-category totals. Every expense event adjusts those totals and then
+# checks the rules for that trip only, so alerts never rescan history:
+#   budget_threshold   spend crossed a fraction of "budget" (BUDGET_ALERT_THRESHOLDS)
+#   projected_overrun  spend per day so far, over the whole trip, exceeds the budget
+#   category_budget    a category went over its entry in "category_budgets"
+# A rule fires once when it starts to hold and re-arms when it stops
+# holding (e.g. after a delete). Alerts go to an AlertHub, which fans them
+# out to the SSE / WebSocket subscribers in main.py.
+import asyncio
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+from trip_currency import DEFAULT_ISO, parse_day, to_iso
+from trip_summary import expense_keys
+
+ALERT_THRESHOLDS = tuple(float(t) for t in os.getenv("BUDGET_ALERT_THRESHOLDS", "0.8,1.0").split(","))
+RECENT_ALERTS = 200
+SUBSCRIBER_QUEUE = 1000
+
+
+class TripBudget:
+    """
+    Running totals of one trip, in its base currency.
+    """
+
+    def __init__(self, trip):
+        self.spent = 0.0
+        self.by_category = {}
+        self.unconverted = {}  # currency label -> amount without an FX rate
+        self.last_day = None   # latest expense day seen (kept on delete)
+        self.fired = set()
+        self.configure(trip)
+
+    def configure(self, trip):
+        self.trip_id = trip.get("id")
+        self.budget = trip.get("budget")
+        self.base = to_iso(trip.get("base_currency") or DEFAULT_ISO)
+        self.start = parse_day(trip.get("start_date"))
+        self.end = parse_day(trip.get("end_date"))
+        self.category_budgets = trip.get("category_budgets") or {}
+
+    def projected(self):
+        """
+        Spend per elapsed day times the trip length, or None if unknown.
+        """
+        if self.last_day is None or np.isnat(self.start) or np.isnat(self.end):
+            return None
+        elapsed = int((self.last_day - self.start).astype(int)) + 1
+        length = int((self.end - self.start).astype(int)) + 1
+        if elapsed < 1 or length < elapsed:
+            return None
+        return self.spent / elapsed * length
+
+    def status(self, trip_index):
+        budget = self.budget
+        projected = self.projected()
+        return {
+            "trip_index": trip_index,
+            "currency": self.base,
+            "budget": budget,
+            "spent": round(self.spent, 2),
+            "remaining": None if budget is None else round(budget - self.spent, 2),
+            "projected": None if projected is None else round(projected, 2),
+            "by_category": {c: round(a, 2) for c, a in self.by_category.items()},
+            "unconverted": [{"currency": c, "amount": round(a, 2)} for c, a in self.unconverted.items() if a],
+        }
+
+
+class BudgetMonitor:
+    def __init__(self, fx, publish):
+        self.fx = fx
+        self._publish = publish
+        self._lock = threading.Lock()
+        self._trips = []
+
+    # ---- listener ----
+    def reset(self, trips):
+        budgets = []
+        for trip_index, trip in enumerate(trips):
+            tb = TripBudget(trip)
+            self._add(tb, trip.get("expenses", []), 1)
+            # A reload is not news: record what holds without publishing.
+            self._evaluate(trip_index, tb, categories=tb.category_budgets, publish=False)
+            budgets.append(tb)
+        with self._lock:
+            self._trips = budgets
+
+    def apply(self, event):
+        op = event["op"]
+        trip_index = event["trip_index"]
+        with self._lock:
+            if op == "add_trip":
+                tb = TripBudget(event["trip"])
+                self._trips.append(tb)
+                self._add(tb, event["trip"].get("expenses", []), 1)
+                categories = tb.category_budgets
+            elif op == "update_trip":
+                trip, tb = event["trip"], self._trips[trip_index]
+                if to_iso(trip.get("base_currency") or DEFAULT_ISO) != tb.base:
+                    # New base currency: the one case that re-converts a trip.
+                    tb = self._trips[trip_index] = TripBudget(trip)
+                    self._add(tb, trip.get("expenses", []), 1)
+                else:
+                    tb.configure(trip)
+                categories = tb.category_budgets
+            else:
+                if op == "add_expense":
+                    removed, added = [], [event["expense"]]
+                elif op == "add_expenses":
+                    removed, added = [], event["expenses"]
+                elif op == "update_expense":
+                    removed, added = [event["old"]], [event["expense"]]
+                elif op == "delete_expense":
+                    removed, added = [event["expense"]], []
+                else:
+                    return
+                tb = self._trips[trip_index]
+                self._add(tb, removed, -1)
+                self._add(tb, added, 1)
+                categories = {expense_keys(e)[2] for e in removed + added}
+            alerts = self._evaluate(trip_index, tb, categories=categories)
+        for alert in alerts:
+            self._publish(alert)
+
+    # ---- totals ----
+    def _add(self, tb, expenses, sign):
+        if not expenses:
+            return
+        keys = [expense_keys(e) for e in expenses]
+        if len(keys) == 1:
+            # One expense per event is the common write: skip the array path.
+            amount, currency, _, day = keys[0]
+            converted = [amount * self.fx.factor(currency, day, tb.base)]
+        else:
+            amounts = [k[0] for k in keys]
+            converted = self.fx.convert(amounts, [k[1] for k in keys], [k[3] for k in keys], tb.base)
+        for (amount, currency, category, day), value in zip(keys, converted):
+            if np.isnan(value):
+                tb.unconverted[currency] = tb.unconverted.get(currency, 0.0) + sign * amount
+                continue
+            tb.spent += sign * value
+            tb.by_category[category] = tb.by_category.get(category, 0.0) + sign * value
+            if sign > 0:
+                parsed = parse_day(day)
+                if not np.isnat(parsed) and (tb.last_day is None or parsed > tb.last_day):
+                    tb.last_day = parsed
+
+    # ---- rules ----
+    def _evaluate(self, trip_index, tb, categories=(), publish=True):
+        alerts = []
+
+        def check(key, holds, rule, message, **details):
+            if not holds:
+                tb.fired.discard(key)
+            elif key not in tb.fired:
+                tb.fired.add(key)
+                alerts.append(dict(
+                    rule=rule, trip_index=trip_index, trip_id=tb.trip_id, currency=tb.base,
+                    spent=round(tb.spent, 2), message=message, time=time.time(), **details,
+                ))
+
+        if tb.budget:
+            for threshold in ALERT_THRESHOLDS:
+                check(
+                    ("budget", threshold), tb.spent >= threshold * tb.budget, "budget_threshold",
+                    f"Spent {tb.spent:,.2f} {tb.base} ({tb.spent / tb.budget:.0%}),"
+                    f" crossing {threshold:.0%} of the {tb.budget:,.0f} budget",
+                    threshold=threshold, budget=tb.budget,
+                )
+            projected = tb.projected()
+            check(
+                ("projection",), projected is not None and projected > tb.budget, "projected_overrun",
+                f"At the current pace the trip will cost about {projected or 0:,.0f} {tb.base}"
+                f" against a {tb.budget:,.0f} budget",
+                projected=None if projected is None else round(projected, 2), budget=tb.budget,
+            )
+        for category in categories:
+            limit = tb.category_budgets.get(category)
+            if limit is None:
+                continue
+            spent = tb.by_category.get(category, 0.0)
+            check(
+                ("category", category), spent >= limit, "category_budget",
+                f"{category}: spent {spent:,.2f} {tb.base} of {limit:,.0f}",
+                category=category, budget=limit,
+            )
+        return alerts if publish else []
+
+    def status(self, trip_index):
+        with self._lock:
+            if trip_index < 0 or trip_index >= len(self._trips):
+                return None
+            return self._trips[trip_index].status(trip_index)
+
+
+class AlertHub:
+    """
+    Recent alerts plus live fan-out to asyncio subscribers. publish() may
+    be called from any thread (store listeners run in worker threads).
+    """
+
+    def __init__(self, size=RECENT_ALERTS):
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=size)
+        self._subscribers = set()
+        self._loop = None
+        self._seq = 0
+
+    def bind(self, loop):
+        self._loop = loop
+
+    def publish(self, alert):
+        with self._lock:
+            self._seq += 1
+            alert = dict(alert, id=self._seq)
+            self._recent.append(alert)
+            subscribers = list(self._subscribers)
+        # The store may reload before bind() is called again for a new loop.
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            for queue in subscribers:
+                loop.call_soon_threadsafe(self._offer, queue, alert)
+
+    @staticmethod
+    def _offer(queue, alert):
+        # A subscriber that stopped reading loses alerts rather than memory.
+        if not queue.full():
+            queue.put_nowait(alert)
+
+    def recent(self, since=0):
+        with self._lock:
+            return [a for a in self._recent if a["id"] > since]
+
+    async def subscribe(self, since=0):
+        """
+        Yield alerts newer than `since` (replayed from the recent buffer),
+        then live ones as they are published.
+        """
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._subscribers.add(queue)
+            backlog = [a for a in self._recent if a["id"] > since]
+        try:
+            last = since
+            for alert in backlog:
+                last = alert["id"]
+                yield alert
+            while True:
+                alert = await queue.get()
+                if alert["id"] > last:
+                    last = alert["id"]
+                    yield alert
+        finally:
+            with self._lock:
+                self._subscribers.discard(queue)
+
+    def stats(self):
+        with self._lock:
+            return {"published": self._seq, "subscribers": len(self._subscribers)}
@@ -0,0 +1,204 @@
+# -----------------------------
+# trip_analytics.py
+# -----------------------------
+# Columnar expense index for cross-trip analytics.
+#
+# ExpenseColumns subscribes to the store like TripSummaries, but keeps
+# every expense as one row of parallel NumPy arrays: float64 amounts,
+# int32 codes for category and currency, datetime64[D] days and the trip
+# index. Adds append rows (amortized O(1), capacity doubles); deletes and
+# updates tombstone the old row via an expense-id -> row map, and the
+# arrays are packed once more than half the rows are dead. Group-by sums,
+# date ranges and top-N are then a mask plus np.bincount over the arrays,
+# optionally after converting every row into one currency (trip_currency).
+import threading
+
+import numpy as np
+
+from trip_currency import parse_day, parse_days, to_iso
+from trip_summary import expense_keys
+
+GROUP_BY = ("category", "currency", "day")
+INITIAL_CAPACITY = 1024
+
+
+class ExpenseColumns:
+    """
+    Store listener holding all expenses as columns.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset([])
+
+    # ---- listener ----
+    def reset(self, trips):
+        rows = [(i, e) for i, t in enumerate(trips) for e in t.get("expenses", [])]
+        with self._lock:
+            self._allocate(max(INITIAL_CAPACITY, 2 * len(rows)))
+            self.categories = {}  # label -> code, in code order
+            self.currencies = {}
+            self._append_rows(rows)
+
+    def apply(self, event):
+        with self._lock:
+            op = event["op"]
+            trip_index = event["trip_index"]
+            if op == "add_trip":
+                self._append_rows([(trip_index, e) for e in event["trip"].get("expenses", [])])
+            elif op == "add_expense":
+                self._append_rows([(trip_index, event["expense"])])
+            elif op == "add_expenses":
+                self._append_rows([(trip_index, e) for e in event["expenses"]])
+            elif op == "update_expense":
+                self._kill(event["old"])
+                self._append_rows([(trip_index, event["expense"])])
+            elif op == "delete_expense":
+                self._kill(event["expense"])
+
+    # ---- storage ----
+    def _allocate(self, capacity):
+        self.size = 0
+        self.dead = 0
+        self.amount = np.zeros(capacity, dtype=np.float64)
+        self.category = np.zeros(capacity, dtype=np.int32)
+        self.currency = np.zeros(capacity, dtype=np.int32)
+        self.day = np.full(capacity, np.datetime64("NaT"), dtype="datetime64[D]")
+        self.trip = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self._rows = {}  # expense id -> row
+
+    def _columns(self):
+        return ("amount", "category", "currency", "day", "trip", "alive")
+
+    def _grow(self, needed):
+        capacity = len(self.amount)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in self._columns():
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            if name == "day":
+                new[:] = np.datetime64("NaT")
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def _append_rows(self, rows):
+        if not rows:
+            return
+        start, stop = self.size, self.size + len(rows)
+        self._grow(stop)
+        keys = [expense_keys(e) for _, e in rows]
+        # setdefault hands out the next code to labels not seen before.
+        categories, currencies = self.categories, self.currencies
+        self.amount[start:stop] = [k[0] for k in keys]
+        self.currency[start:stop] = [currencies.setdefault(k[1], len(currencies)) for k in keys]
+        self.category[start:stop] = [categories.setdefault(k[2], len(categories)) for k in keys]
+        self.day[start:stop] = parse_days([k[3] for k in keys])
+        self.trip[start:stop] = [trip_index for trip_index, _ in rows]
+        self._rows.update((e.get("id"), row) for row, (_, e) in enumerate(rows, start))
+        self._rows.pop(None, None)
+        self.alive[start:stop] = True
+        self.size = stop
+
+    def _kill(self, expense):
+        row = self._rows.pop(expense.get("id"), None)
+        if row is None:
+            return
+        self.alive[row] = False
+        self.dead += 1
+        if self.dead > self.size // 2:
+            self._pack()
+
+    def _pack(self):
+        keep = np.flatnonzero(self.alive[: self.size])
+        remap = np.full(self.size, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        for name in self._columns():
+            column = getattr(self, name)
+            column[: len(keep)] = column[keep]
+        self.alive[len(keep): self.size] = False
+        self._rows = {expense_id: int(remap[row]) for expense_id, row in self._rows.items()}
+        self.size = len(keep)
+        self.dead = 0
+
+    # ---- queries ----
+    def _mask(self, trip_index=None, date_from=None, date_to=None):
+        n = self.size
+        mask = self.alive[:n].copy()
+        if trip_index is not None:
+            mask &= self.trip[:n] == trip_index
+        if date_from is not None:
+            mask &= self.day[:n] >= parse_day(date_from)
+        if date_to is not None:
+            mask &= self.day[:n] <= parse_day(date_to)
+        return mask
+
+    def _group(self, by, mask, fx=None, to=None):
+        """
+        (group labels, currency labels, sums, counts) with one cell per
+        (group, currency) pair: cell = group_code * n_currencies + currency.
+        With `to`, amounts are converted by FxTable `fx` first and rows
+        without a known rate are left out.
+        """
+        n = self.size
+        amounts = self.amount[:n][mask]
+        currencies = self.currency[:n][mask].astype(np.int64)
+        days = self.day[:n][mask]
+        currency_labels = list(self.currencies)
+        if by == "currency":
+            codes, labels = np.zeros(len(amounts), dtype=np.int64), [None]
+        elif by == "category":
+            codes, labels = self.category[:n][mask].astype(np.int64), list(self.categories)
+        else:
+            unique_days, codes = np.unique(days, return_inverse=True)
+            labels = ["unknown" if np.isnat(d) else str(d) for d in unique_days]
+        if to is not None:
+            factors = fx.factors(currencies, [to_iso(c) for c in currency_labels], days, to)
+            known = ~np.isnan(factors)
+            codes, amounts = codes[known], amounts[known] * factors[known]
+            currencies = np.zeros(len(codes), dtype=np.int64)
+            currency_labels = [to]
+        n_cur = max(len(currency_labels), 1)
+        cells = codes * n_cur + currencies
+        size = max(len(labels), 1) * n_cur
+        sums = np.bincount(cells, weights=amounts, minlength=size)
+        counts = np.bincount(cells, minlength=size)
+        return labels, currency_labels, sums, counts
+
+    def group_sum(self, by="category", trip_index=None, date_from=None, date_to=None, fx=None, to=None):
+        """
+        Totals per (group, currency): [{by: label, "currency", "amount", "count"}]
+        for by in GROUP_BY; "day" rows come in date order. With `to` (an
+        ISO code) and `fx`, everything is converted into that one currency.
+        """
+        with self._lock:
+            mask = self._mask(trip_index, date_from, date_to)
+            labels, currency_labels, sums, counts = self._group(by, mask, fx, to)
+        return [self._row(by, labels, currency_labels, cell, sums, counts) for cell in np.flatnonzero(counts)]
+
+    def top(self, n=10, by="category", trip_index=None, date_from=None, date_to=None, fx=None, to=None):
+        """
+        The `n` largest (group, currency) totals, largest first.
+        """
+        with self._lock:
+            mask = self._mask(trip_index, date_from, date_to)
+            labels, currency_labels, sums, counts = self._group(by, mask, fx, to)
+        cells = np.flatnonzero(counts)
+        if len(cells) > n:
+            cells = cells[np.argpartition(-sums[cells], n - 1)[:n]]
+        cells = cells[np.argsort(-sums[cells], kind="stable")]
+        return [self._row(by, labels, currency_labels, cell, sums, counts) for cell in cells]
+
+    @staticmethod
+    def _row(by, labels, currency_labels, cell, sums, counts):
+        group, currency = divmod(int(cell), max(len(currency_labels), 1))
+        row = {} if by == "currency" else {"date" if by == "day" else by: labels[group]}
+        row.update(currency=currency_labels[currency], amount=round(float(sums[cell]), 2), count=int(counts[cell]))
+        return row
+
+    def stats(self):
+        with self._lock:
+            return {"rows": self.size - self.dead, "dead": self.dead, "capacity": len(self.amount)}
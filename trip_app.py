@@ -1,19 +1,12 @@
 import streamlit as st
 import requests
-import json
-import os
+from trip_client import last_known_trips, load_expenses, load_trips, send
+from trip_utils import stream_ai_answer
 
 FASTAPI_URL = "http://127.0.0.1:8000"
 
 DATA_FILE = "trip_data.json"
 
-# Utility to load local trips (from FastAPI’s JSON)
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, "r") as f:
-        return json.load(f)
-
 # UI
 st.set_page_config(page_title="Trip Planner", layout="centered")
 
@@ -35,16 +28,20 @@ with st.sidebar.form("new_trip"):
             "expenses": [],
         }
         # Save via FastAPI
-        res = requests.post(f"{FASTAPI_URL}/trip_data", json=trip_data)
+        res = send(FASTAPI_URL, "POST", "/trip_data", json=trip_data)
         st.sidebar.success("Trip added!")
 
-# Select trip
-trips = load_data()
+# Select trip (synced by deltas; the last known trips if the server is down)
+trips, versions = load_trips(FASTAPI_URL)
+if trips is None:
+    trips = last_known_trips(FASTAPI_URL, DATA_FILE)
 trip_names = [f"{i}. {t['destination']}" for i, t in enumerate(trips)]
 trip_index = st.selectbox("Select a Trip", range(len(trips)), format_func=lambda i: trip_names[i] if trips else "No trips")
 
 if trips:
     selected_trip = trips[trip_index]
+    if versions is not None:
+        selected_trip["expenses"] = load_expenses(FASTAPI_URL, trip_index) or []
     st.subheader(f"✈️ {selected_trip['destination']} ({selected_trip['start_date']} → {selected_trip['end_date']})")
 
        # Add expense
@@ -67,7 +64,7 @@ if trips:
                 "currency": currency,   # save currency
                 "description": description,
             }
-            res = requests.post(f"{FASTAPI_URL}/trip_data/{trip_index}/expense", json=expense)
+            res = send(FASTAPI_URL, "POST", f"/trip_data/{trip_index}/expense", json=expense)
             st.success("Expense added!")
 
     # Show expenses
@@ -104,8 +101,8 @@ if trips:
                   st.write(f"{i+1}. {date} | {category} | {amount} {currency} | {description}")
                with col2:
                    if st.button(f"Delete Expense {i+1}", key=f"del_{i}"):
-                      res = requests.delete(f"{FASTAPI_URL}/trip_data/{trip_index}/expense/{i}")
-                      if res.ok:
+                      res = send(FASTAPI_URL, "DELETE", f"/trip_data/{trip_index}/expense/{i}")
+                      if res:
                           st.success(f"Deleted expense {i+1}")
                           st.experimental_rerun()  # refresh UI
                    else:
@@ -116,9 +113,7 @@ if trips:
 
     # AI Itinerary
     if st.button("🧠 Generate AI Itinerary"):
-        question = f"Plan a trip to {selected_trip['destination']} from {selected_trip['start_date']} to {selected_trip['end_date']}, considering these expenses: {selected_trip['expenses']}. Suggest activities within budget."
-        res = requests.post(f"{FASTAPI_URL}/ask_ai", json={"question": question})
-        if res.ok:
-            st.markdown(res.json()["answer"])
-        else:
+        try:
+            st.write_stream(stream_ai_answer(FASTAPI_URL, trip_index))
+        except requests.RequestException:
             st.error("AI request failed.")
\ No newline at end of file
@@ -0,0 +1,298 @@
+# -----------------------------
+# trip_changes.py
+# -----------------------------
+# Incremental sync: the server's change feed and the client replica that
+# follows it.
+#
+# ChangeFeed subscribes to the store like TripVersions. Every mutation
+# gets the next sequence number and is kept, in compact form, in a ring of
+# the last CHANGES_KEEP changes; GET /changes?since=N (main.py) returns
+# the ones after N, so a client that is up to date pays for one small
+# response and one that is behind pays for what changed, not for the
+# whole dataset. A client must start over from a full fetch ("reset")
+# when its `since` is older than the ring, predates a store reload, or
+# comes from an earlier server run (the epoch differs).
+#
+# Changes name trips by index (trips are only ever appended) and expenses
+# by id, and TripReplica applies them as upserts/deletes by id. Replaying
+# a change the replica already has is therefore harmless, which is what
+# makes a reset safe: take the feed position first, fetch the trips, then
+# apply everything after that position.
+import asyncio
+import collections
+import itertools
+import os
+import threading
+import time
+
+import requests
+
+CHANGES_KEEP = int(os.getenv("TRIP_CHANGES_KEEP", "10000"))
+
+
+def compact_change(seq, trip_id, event):
+    """
+    The wire form of one store event: what a replica needs, nothing more.
+    """
+    op = event["op"]
+    change = {"seq": seq, "op": op, "trip_index": event["trip_index"], "trip_id": trip_id}
+    if op == "add_trip":
+        # Copy the expense list: the store keeps appending to the original.
+        trip = event["trip"]
+        change["trip"] = dict(trip, expenses=list(trip.get("expenses", [])))
+    elif op == "update_trip":
+        change["fields"] = dict(event["fields"])
+    elif op in ("add_expense", "update_expense"):
+        change["expense"] = event["expense"]
+    elif op == "add_expenses":
+        change["expenses"] = list(event["expenses"])
+    elif op == "delete_expense":
+        change["expense_id"] = event["expense"].get("id")
+    if "expense_index" in event:
+        change["expense_index"] = event["expense_index"]  # a position hint only
+    return change
+
+
+class ChangeFeed:
+    def __init__(self, keep=CHANGES_KEEP):
+        self._lock = threading.Lock()
+        self.epoch = format(time.time_ns() // 1000, "x")
+        self._seq = 0
+        self._reset_seq = 0
+        self._changes = collections.deque(maxlen=keep)
+        self._trip_ids = []
+        self._loop = None
+        self._changed = None
+
+    def bind(self, loop):
+        self._loop = loop
+        self._changed = asyncio.Event()
+
+    # ---- listener ----
+    def reset(self, trips):
+        # The trips may have changed in any way: every client resyncs.
+        with self._lock:
+            self._seq += 1
+            self._reset_seq = self._seq
+            self._changes.clear()
+            self._trip_ids = [t.get("id") for t in trips]
+        self._notify()
+
+    def apply(self, event):
+        with self._lock:
+            self._seq += 1
+            if event["op"] == "add_trip":
+                self._trip_ids.append(event["trip"].get("id"))
+            trip_index = event["trip_index"]
+            trip_id = self._trip_ids[trip_index] if 0 <= trip_index < len(self._trip_ids) else None
+            self._changes.append(compact_change(self._seq, trip_id, event))
+        self._notify()
+
+    def _notify(self):
+        # The store may reload before bind() is called again for a new loop.
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    # ---- queries ----
+    def latest(self):
+        with self._lock:
+            return self._seq
+
+    def since(self, since, limit=None, epoch=None):
+        """
+        {"epoch", "seq", "latest", "reset", "changes"}: the changes after
+        `since`, oldest first, at most `limit` of them. "seq" is where the
+        client stands after applying them. With "reset" there are no
+        changes: fetch every trip, then continue from "seq".
+        """
+        with self._lock:
+            first = self._changes[0]["seq"] if self._changes else self._seq + 1
+            stale = (
+                (epoch is not None and epoch != self.epoch)
+                or since < self._reset_seq
+                or since < first - 1
+                or since > self._seq
+            )
+            if stale:
+                changes, seq = [], self._seq
+            else:
+                start = since - first + 1
+                stop = None if limit is None else start + limit
+                changes = list(itertools.islice(self._changes, start, stop))
+                seq = changes[-1]["seq"] if changes else since
+            return {"epoch": self.epoch, "seq": seq, "latest": self._seq, "reset": stale, "changes": changes}
+
+    async def wait(self, since, timeout):
+        """
+        Wait up to `timeout` seconds for a change after `since`; returns
+        whether there is one. Call from the event loop passed to bind().
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.latest() <= since:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def follow(self, since, epoch=None, limit=None):
+        """
+        Yield every batch from since() as changes arrive; a reset batch
+        restarts the client from its "seq".
+        """
+        while True:
+            batch = self.since(since, limit=limit, epoch=epoch)
+            epoch = self.epoch
+            if batch["reset"] or batch["changes"]:
+                yield batch
+            since = batch["seq"]
+            if since >= batch["latest"]:
+                await self.wait(since, 3600)
+
+    def stats(self):
+        with self._lock:
+            return {"seq": self._seq, "kept": len(self._changes), "reset_seq": self._reset_seq}
+
+
+# -----------------------------
+# Client side
+# -----------------------------
+def _find_expense(expenses, expense_id, hint=None):
+    if hint is not None and 0 <= hint < len(expenses) and expenses[hint].get("id") == expense_id:
+        return hint
+    return next((i for i, e in enumerate(expenses) if e.get("id") == expense_id), None)
+
+
+def apply_change(trips, change):
+    """
+    Apply one change from the feed to a list of trips, in place. Upserts
+    and deletes by id, so applying a change twice changes nothing.
+    """
+    op = change["op"]
+    trip_index = change["trip_index"]
+    if op == "add_trip":
+        trip = dict(change["trip"], expenses=list(change["trip"].get("expenses", [])))
+        if trip_index < len(trips):
+            trips[trip_index] = trip
+        else:
+            trips.append(trip)
+        return
+    if trip_index >= len(trips):
+        return
+    trip = trips[trip_index]
+    if op == "update_trip":
+        trips[trip_index] = dict(trip, **change["fields"])
+        return
+    expenses = trip.setdefault("expenses", [])
+    if op == "delete_expense":
+        position = _find_expense(expenses, change["expense_id"], change.get("expense_index"))
+        if position is not None:
+            expenses.pop(position)
+        return
+    added = change["expenses"] if op == "add_expenses" else [change["expense"]]
+    for expense in added:
+        position = _find_expense(expenses, expense.get("id"), change.get("expense_index"))
+        if position is None:
+            expenses.append(expense)
+        else:
+            expenses[position] = expense
+
+
+class TripReplica:
+    """
+    A local copy of every trip, kept current through GET /changes. Safe to
+    share between threads; readers get copies they may modify.
+    """
+
+    def __init__(self, fastapi_url, session=None, limit=1000):
+        self.fastapi_url = fastapi_url
+        self.session = session or requests.Session()
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._trips = None  # None until the first successful sync
+        self._trip_seq = []  # seq of the last change to each trip
+        self.epoch = None
+        self.seq = 0
+        self.resets = 0
+        self.applied = 0
+
+    def _get(self, path, timeout, **params):
+        res = self.session.get(f"{self.fastapi_url}{path}", params=params, timeout=timeout)
+        res.raise_for_status()
+        return res.json()
+
+    def sync(self, wait=0, timeout=10):
+        """
+        Bring the replica up to date. With `wait`, long-poll: block up to
+        that many seconds for the next change when there is none yet.
+        Returns False if the server could not be reached; the last known
+        trips are kept.
+        """
+        with self._lock:
+            try:
+                while True:
+                    params = {"since": self.seq, "limit": self.limit}
+                    if self.epoch is not None:
+                        params["epoch"] = self.epoch
+                    if wait:
+                        params["wait"] = wait
+                    batch = self._get("/changes", timeout + wait, **params)
+                    if batch["reset"]:
+                        self._trips = self._get("/trip_data", timeout)
+                        self._trip_seq = [batch["seq"]] * len(self._trips)
+                        self.resets += 1
+                    for change in batch["changes"]:
+                        apply_change(self._trips, change)
+                        i = change["trip_index"]
+                        self._trip_seq[i:i + 1] = [change["seq"]]
+                    self.applied += len(batch["changes"])
+                    self.epoch, self.seq = batch["epoch"], batch["seq"]
+                    if self.seq >= batch["latest"]:
+                        return True
+                    wait = 0
+            except (requests.RequestException, ValueError):
+                return False
+
+    @property
+    def ready(self):
+        return self._trips is not None
+
+    def trips(self, with_expenses=False):
+        """
+        Copies of the trips (without their expenses unless asked), or None
+        before the first sync.
+        """
+        with self._lock:
+            if self._trips is None:
+                return None
+            if with_expenses:
+                return [dict(t, expenses=list(t.get("expenses", []))) for t in self._trips]
+            return [{k: v for k, v in t.items() if k != "expenses"} for t in self._trips]
+
+    def expenses(self, trip_index, offset=0, limit=None):
+        with self._lock:
+            if self._trips is None or not 0 <= trip_index < len(self._trips):
+                return None
+            expenses = self._trips[trip_index].get("expenses", [])
+            return expenses[offset:None if limit is None else offset + limit]
+
+    def versions(self):
+        """
+        {"version": tag, "trips": [tag per trip]}, like /trip_data/versions:
+        cache keys that move when the replica's copy changes.
+        """
+        with self._lock:
+            return {"version": f"{self.epoch}-{self.seq}", "trips": [f"{self.epoch}-{s}" for s in self._trip_seq]}
+
+    def stats(self):
+        with self._lock:
+            return {"seq": self.seq, "resets": self.resets, "applied": self.applied}
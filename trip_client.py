@@ -0,0 +1,168 @@
+# -----------------------------
+# trip_client.py
+# -----------------------------
+# Data access for the Streamlit pages.
+#
+# Every server call goes through one pooled requests.Session, shared by
+# all sessions of the app (st.cache_resource). The trips live in one
+# process-wide TripReplica (trip_changes.py): a rerun costs one small
+# GET /changes, and a mutation costs the delta, never a refetch of the
+# trips. Summaries are cached with st.cache_data under the replica's
+# per-trip version tags, so the pages never need to clear a cache
+# themselves. Without a server, the pages show the replica's last known
+# trips (or the JSON file, through load_local(), if the server was never
+# reached) and queue their writes in the outbox (trip_outbox.py).
+import os
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+from trip_changes import TripReplica
+from trip_ids import new_id
+from trip_outbox import Outbox, OutboxFlusher, request_for, retryable
+from trip_store import read_snapshot
+
+POOL_SIZE = 16
+
+
+@st.cache_resource
+def http_session():
+    """
+    The app-wide keep-alive session (one connection pool per process).
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource
+def outbox(fastapi_url):
+    """
+    The app-wide offline write queue, with its flusher thread running.
+    """
+    box = Outbox()
+    box.flusher = OutboxFlusher(box, fastapi_url, http_session()).start()
+    return box
+
+
+@st.cache_resource
+def replica(fastapi_url):
+    """
+    The app-wide copy of the server's trips, synced by deltas.
+    """
+    return TripReplica(fastapi_url, http_session())
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _trip_summary(fastapi_url, trip_index, version):
+    res = http_session().get(f"{fastapi_url}/trip_data/{trip_index}/summary", timeout=10)
+    res.raise_for_status()
+    return res.json()
+
+
+def load_trips(fastapi_url):
+    """
+    (trips without their expenses, versions), or (None, None) if the
+    server is unreachable.
+    """
+    trips = replica(fastapi_url)
+    if not trips.sync():
+        return None, None
+    return trips.trips(), trips.versions()
+
+
+def last_known_trips(fastapi_url, path):
+    """
+    Trips with expenses for offline use: the replica's last synced state,
+    else the JSON file.
+    """
+    trips = replica(fastapi_url).trips(with_expenses=True)
+    return load_local(path) if trips is None else trips
+
+
+def _trip_version(versions, trip_index):
+    return versions["trips"][trip_index] if trip_index < len(versions["trips"]) else None
+
+
+def load_expenses(fastapi_url, trip_index):
+    """
+    The trip's expenses as of the last sync (a copy); None if unknown.
+    The replica is the cache here, so no version key is needed.
+    """
+    return replica(fastapi_url).expenses(trip_index)
+
+
+def load_expense_page(fastapi_url, trip_index, offset, limit):
+    """
+    One page of the trip's expenses as of the last sync; None if unknown.
+    """
+    return replica(fastapi_url).expenses(trip_index, offset, limit)
+
+
+def load_summary(fastapi_url, trip_index, versions):
+    """
+    The trip's /summary payload, cached until that trip changes; None on failure.
+    """
+    try:
+        return _trip_summary(fastapi_url, trip_index, _trip_version(versions, trip_index))
+    except requests.RequestException:
+        return None
+
+
+def send(fastapi_url, method, path, timeout=10, **kwargs):
+    """
+    Mutating request over the shared session. Returns the response, or
+    None if the server could not take the request right now (unreachable,
+    timed out, or a transient error status) and it is worth queueing.
+    """
+    try:
+        res = http_session().request(method, f"{fastapi_url}{path}", timeout=timeout, **kwargs)
+    except requests.RequestException:
+        return None
+    return None if retryable(res.status_code) else res
+
+
+def write(fastapi_url, op, trip, body):
+    """
+    Apply one outbox-style mutation (trip_outbox.py) now, or queue it if
+    the server cannot take it. The attempt and the queued entry share one
+    request and one idempotency key, so a write that reached the server
+    before its reply was lost is not applied twice. Returns the server's
+    response (check .ok: a 4xx is final and is not queued), or None if
+    the write was queued.
+    """
+    key = new_id()
+    method, path, json_body = request_for(op, trip, body)
+    res = send(fastapi_url, method, path, json=json_body, headers={"Idempotency-Key": key})
+    if res is None:
+        outbox(fastapi_url).enqueue(op, trip, body, key=key)
+    return res
+
+
+def error_detail(res):
+    """
+    The "detail" of an error response, for showing to the user.
+    """
+    try:
+        return res.json().get("detail", res.text)
+    except ValueError:
+        return res.text
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _read_json(path, mtime_ns, size):
+    return read_snapshot(path)
+
+
+def load_local(path):
+    """
+    Trips from the JSON file, parsed again only when the file changed.
+    """
+    try:
+        info = os.stat(path)
+    except FileNotFoundError:
+        return []
+    return _read_json(path, info.st_mtime_ns, info.st_size)
@@ -0,0 +1,172 @@
+# -----------------------------
+# trip_currency.py
+# -----------------------------
+# Currency labels -> ISO 4217 codes, and conversion between codes using
+# the date-keyed rates in FX_RATES_FILE (CSV: date,currency,rate where
+# rate is the price of one unit of `currency` in THB on that date).
+#
+# FxTable keeps one sorted (day, rate) series per currency in NumPy
+# arrays and interpolates linearly between the dates in the file; outside
+# the covered range the nearest rate is used. The file is re-read when
+# its mtime changes, so new rates need no restart. Single conversions
+# (factor()) are memoized per (currency, day, target) until then.
+import csv
+import functools
+import os
+import threading
+
+import numpy as np
+
+FX_RATES_FILE = os.getenv("FX_RATES_FILE", "fx_rates.csv")
+PIVOT = "THB"
+DEFAULT_ISO = "THB"
+FACTOR_CACHE_SIZE = 65536
+
+# Symbols and words seen in labels, lowercased.
+SYMBOLS = {
+    "฿": "THB", "baht": "THB",
+    "$": "USD", "us$": "USD", "dollar": "USD",
+    "€": "EUR", "euro": "EUR",
+    "£": "GBP", "¥": "JPY", "yen": "JPY",
+}
+# How the Streamlit pages label the currencies they offer.
+LABELS = {"THB": "THB (฿)", "USD": "USD ($)"}
+
+
+def parse_day(value):
+    try:
+        return np.datetime64(str(value or "")[:10], "D")
+    except ValueError:
+        return np.datetime64("NaT", "D")
+
+
+def parse_days(values):
+    """
+    datetime64[D] array from ISO date strings; unparsable values become NaT.
+    """
+    # One C-level parse for the common all-ISO case; row by row otherwise.
+    try:
+        return np.array([str(v)[:10] for v in values], dtype="datetime64[D]")
+    except ValueError:
+        return np.array([parse_day(v) for v in values], dtype="datetime64[D]")
+
+
+@functools.lru_cache(maxsize=1024)
+def to_iso(label):
+    """
+    "THB (฿)" -> "THB", "usd" -> "USD", "฿" -> "THB", missing -> DEFAULT_ISO.
+    """
+    text = str(label or "").strip()
+    if not text:
+        return DEFAULT_ISO
+    lowered = text.lower()
+    if lowered in SYMBOLS:
+        return SYMBOLS[lowered]
+    head = text[:3]
+    if head.isalpha() and head.isascii() and (len(text) == 3 or not text[3].isalpha()):
+        return head.upper()
+    for symbol, iso in SYMBOLS.items():
+        if symbol in lowered:
+            return iso
+    return text.upper()
+
+
+def display_label(label):
+    """
+    The label the pages use for `label`'s currency, e.g. "thb" -> "THB (฿)".
+    """
+    iso = to_iso(label)
+    return LABELS.get(iso, iso)
+
+
+class FxTable:
+    def __init__(self, path=FX_RATES_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._series = {}  # ISO code -> (days as int64, rates)
+        self._factors = {}  # (currency, day, to) -> multiplier, for the current series
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            if signature == self._signature:
+                return self._series
+            points = {}
+            if signature is not None:
+                with open(self.path, "r", encoding="utf-8", newline="") as f:
+                    for row in csv.DictReader(f):
+                        day = np.datetime64(row["date"].strip(), "D").astype(np.int64)
+                        points.setdefault(to_iso(row["currency"]), []).append((day, float(row["rate"])))
+            series = {}
+            for iso, values in points.items():
+                values.sort()
+                days, rates = zip(*values)
+                series[iso] = (np.array(days, dtype=np.int64), np.array(rates, dtype=np.float64))
+            self._series, self._signature = series, signature
+            self._factors = {}
+            return series
+
+    def currencies(self):
+        return {PIVOT} | set(self._refresh())
+
+    def rates(self, iso, days):
+        """
+        THB per unit of `iso` on each of `days` (datetime64[D]); NaN when
+        the currency has no rates. Rows without a date get the latest rate.
+        """
+        days = np.asarray(days, dtype="datetime64[D]")
+        if iso == PIVOT:
+            return np.ones(len(days))
+        series = self._refresh().get(iso)
+        if series is None:
+            return np.full(len(days), np.nan)
+        known, rates = series
+        result = np.interp(days.astype(np.int64), known, rates)
+        result[np.isnat(days)] = rates[-1]
+        return result
+
+    def factors(self, codes, isos, days, to):
+        """
+        Per-row multipliers into currency `to`, for rows whose currency is
+        isos[code]; NaN where a rate is missing.
+        """
+        codes = np.asarray(codes)
+        days = np.asarray(days, dtype="datetime64[D]")
+        result = np.full(len(codes), np.nan)
+        target = self.rates(to, days)
+        for code in np.unique(codes):
+            rows = codes == code
+            iso = isos[code]
+            result[rows] = 1.0 if iso == to else self.rates(iso, days[rows]) / target[rows]
+        return result
+
+    def factor(self, currency, day, to):
+        """
+        The multiplier from `currency` (a label or ISO code) into `to` on
+        ISO date `day`, NaN without a rate: factors() for one row, without
+        the array setup. Cached until the rates file changes.
+        """
+        self._refresh()
+        cache = self._factors
+        key = (currency, day, to)
+        value = cache.get(key)
+        if value is None:
+            if len(cache) >= FACTOR_CACHE_SIZE:
+                cache.clear()
+            value = cache[key] = float(self.factors([0], [to_iso(currency)], [parse_day(day)], to_iso(to))[0])
+        return value
+
+    def convert(self, amounts, currencies, days, to):
+        """
+        Convert many amounts in one call: `currencies` are labels or ISO
+        codes, `days` ISO dates. Returns a float64 array (NaN = no rate).
+        """
+        labels, codes = np.unique(np.asarray(currencies, dtype=object).astype(str), return_inverse=True)
+        isos = [to_iso(label) for label in labels]
+        factors = self.factors(codes, isos, parse_days(days), to_iso(to))
+        return np.asarray(amounts, dtype=np.float64) * factors
@@ -0,0 +1,182 @@
+# -----------------------------
+# trip_export.py
+# -----------------------------
+# Streaming expense export for main.py's /export endpoints.
+#
+# Rows are produced one trip at a time straight from the store and encoded
+# in chunks of EXPORT_CHUNK_ROWS, so a multi-trip export never holds a
+# DataFrame or the whole file in memory:
+#   csv      written row by row, the download starts with the first chunk
+#   xlsx     openpyxl write-only mode (rows spill to a temp file; the zip
+#            container can only be streamed once the workbook is saved)
+#   parquet  pyarrow, one row group per chunk (optional dependency)
+import csv
+import importlib
+import io
+import os
+import tempfile
+
+from trip_summary import DEFAULT_CURRENCY
+
+EXPORT_CHUNK_ROWS = int(os.getenv("TRIP_EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_TRIP_PAGE = 100
+FILE_CHUNK_BYTES = 64 * 1024
+
+EXPORT_COLUMNS = (
+    "trip_index", "trip_id", "destination", "expense_id",
+    "date", "category", "amount", "currency", "description",
+)
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+REQUIRES = {"xlsx": ("openpyxl",), "parquet": ("pyarrow", "pyarrow.parquet")}
+
+
+# -----------------------------
+# Rows
+# -----------------------------
+def _expense_rows(trip_index, trip):
+    for e in trip.get("expenses", []):
+        yield (
+            trip_index, trip.get("id"), trip.get("destination", ""), e.get("id"),
+            e.get("date", ""), e.get("category", ""), float(e.get("amount", 0.0) or 0.0),
+            e.get("currency") or DEFAULT_CURRENCY, e.get("description") or "",
+        )
+
+
+def iter_rows(store, trip_index=None):
+    """
+    Export rows (EXPORT_COLUMNS order) for one trip or for every trip.
+    A missing trip raises TripNotFound here, before any row is produced.
+    """
+    if trip_index is not None:
+        return _expense_rows(trip_index, store.get_trip(trip_index))
+
+    def all_trips():
+        cursor = 0
+        while cursor is not None:
+            page, cursor = store.page_trips(cursor=cursor, limit=EXPORT_TRIP_PAGE)
+            for index, trip in page:
+                yield from _expense_rows(index, trip)
+
+    return all_trips()
+
+
+def chunked(rows, size=EXPORT_CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# -----------------------------
+# Encoders
+# -----------------------------
+def csv_stream(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel shows "฿" correctly; trip_import reads it back as utf-8-sig.
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in chunked(rows):
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def xlsx_stream(rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Expenses")
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            data = f.read(FILE_CHUNK_BYTES)
+            if not data:
+                break
+            yield data
+
+
+class _ByteSink:
+    """
+    Write-only file object that hands back what was written since the
+    last drain(), so the Parquet writer's output can be streamed.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_stream(rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("trip_index", pa.int64()), ("trip_id", pa.string()), ("destination", pa.string()),
+        ("expense_id", pa.string()), ("date", pa.string()), ("category", pa.string()),
+        ("amount", pa.float64()), ("currency", pa.string()), ("description", pa.string()),
+    ])
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in chunked(rows):
+            columns = dict(zip(EXPORT_COLUMNS, map(list, zip(*chunk))))
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {"csv": csv_stream, "xlsx": xlsx_stream, "parquet": parquet_stream}
+
+
+def export_stream(store, fmt, trip_index=None):
+    """
+    Iterator of file bytes for `fmt` ("csv", "xlsx" or "parquet").
+    Raises ModuleNotFoundError up front if the format's library is missing.
+    """
+    for module in REQUIRES.get(fmt, ()):
+        importlib.import_module(module)
+    return ENCODERS[fmt](iter_rows(store, trip_index))
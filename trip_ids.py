@@ -0,0 +1,28 @@
+# -----------------------------
+# trip_ids.py
+# -----------------------------
+# ULIDs for trips and expenses: 48-bit millisecond timestamp + 80 random
+# bits, as 26 Crockford base32 characters. They sort by creation time and
+# need no coordination, so offline clients can mint them too.
+import os
+import time
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+
+def new_id():
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), "big")
+    chars = []
+    for _ in range(26):
+        chars.append(_CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def with_id(record):
+    """
+    `record` with an "id", keeping one the client already chose.
+    """
+    if record.get("id"):
+        return record
+    return dict(record, id=new_id())
@@ -0,0 +1,223 @@
+# -----------------------------
+# trip_import.py
+# -----------------------------
+# Streaming expense import from XLSX (openpyxl read-only mode) and CSV.
+#
+# Rows are read one at a time, mapped onto the Expense fields and handed
+# to the store in batches of IMPORT_BATCH, so memory stays flat however
+# long the sheet is. Used by POST /trip_data/{i}/import and from the
+# command line (writes straight to the store, so stop the API first):
+#   python trip_import.py trip_expenses.xlsx TRIP_INDEX [trip_data.json]
+#
+# A file that cannot be read at all raises UnreadableFile. Since batches
+# are stored as they are read, a failure after the first batch raises
+# PartialImport instead, which says how much was already added.
+import csv
+import datetime
+import io
+import itertools
+import os
+import sys
+
+from trip_currency import display_label
+from trip_summary import DEFAULT_CURRENCY
+
+IMPORT_BATCH = int(os.getenv("TRIP_IMPORT_BATCH", "5000"))
+MAX_REPORTED_ERRORS = 100
+
+# Header spellings seen in our own exports and in travel-card statements.
+COLUMN_ALIASES = {
+    "date": ("date", "transaction date", "posted date", "posting date"),
+    "category": ("category", "type"),
+    "amount": ("amount", "value", "total", "cost"),
+    "currency": ("currency", "ccy"),
+    "description": ("description", "details", "merchant", "note", "notes"),
+}
+
+
+class UnreadableFile(ValueError):
+    """
+    Not a readable CSV/XLSX file, or one without the required columns.
+    """
+
+
+class PartialImport(Exception):
+    """
+    The import failed (see __cause__) after `added` expenses were stored.
+    """
+
+    def __init__(self, added, skipped, errors):
+        super().__init__(f"import stopped after {added} expenses were added")
+        self.added = added
+        self.skipped = skipped
+        self.errors = errors
+
+
+def normalize_currency(label):
+    label = str(label or "").strip()
+    if not label:
+        return DEFAULT_CURRENCY
+    return display_label(label)
+
+
+# -----------------------------
+# Row sources
+# -----------------------------
+def sniff_format(f):
+    """
+    "xlsx" for a zip container, otherwise "csv". `f` must be seekable.
+    """
+    head = f.read(4)
+    f.seek(0)
+    return "xlsx" if head.startswith(b"PK") else "csv"
+
+
+def iter_xlsx_rows(f):
+    from openpyxl import load_workbook
+
+    # Nothing but parsing happens in here, so any error means a bad file.
+    try:
+        workbook = load_workbook(f, read_only=True, data_only=True)
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    except Exception as e:
+        raise UnreadableFile(f"not a readable XLSX file: {e}") from e
+
+
+def iter_csv_rows(f):
+    try:
+        yield from csv.reader(io.TextIOWrapper(f, encoding="utf-8-sig", newline=""))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise UnreadableFile(f"not a readable CSV file: {e}") from e
+
+
+def map_columns(header):
+    """
+    {field: column position} for the Expense fields found in `header`.
+    """
+    names = [str(h or "").strip().lower() for h in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                columns[field] = names.index(alias)
+                break
+    return columns
+
+
+# -----------------------------
+# Row -> expense
+# -----------------------------
+def _date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value or "").strip()
+
+
+def _amount(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value or "").strip().replace(",", "")
+    for symbol in ("฿", "$"):
+        text = text.replace(symbol, "")
+    return float(text)
+
+
+def row_to_expense(row, columns):
+    def cell(field):
+        position = columns.get(field)
+        return row[position] if position is not None and position < len(row) else None
+
+    date = _date(cell("date"))
+    category = str(cell("category") or "").strip()
+    if not date:
+        raise ValueError("missing date")
+    if not category:
+        raise ValueError("missing category")
+    try:
+        amount = _amount(cell("amount"))
+    except ValueError:
+        raise ValueError(f"invalid amount {cell('amount')!r}")
+    return {
+        "date": date,
+        "category": category,
+        "amount": amount,
+        "currency": normalize_currency(cell("currency")),
+        "description": str(cell("description") or "").strip(),
+    }
+
+
+def iter_expenses(f, fmt=None):
+    """
+    Yield (row_number, expense or error message) for each data row of the
+    binary file `f`; row numbers are 1-based sheet rows, header included.
+    """
+    rows = iter_xlsx_rows(f) if (fmt or sniff_format(f)) == "xlsx" else iter_csv_rows(f)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = map_columns(header)
+    missing = [field for field in ("date", "category", "amount") if field not in columns]
+    if missing:
+        raise UnreadableFile(f"Missing column(s): {', '.join(missing)}")
+    for row_number, row in enumerate(rows, start=2):
+        if not any(v not in (None, "") for v in row):
+            continue
+        try:
+            yield row_number, row_to_expense(row, columns)
+        except ValueError as e:
+            yield row_number, str(e)
+
+
+def import_expenses(store, trip_index, f, fmt=None, batch_size=IMPORT_BATCH):
+    """
+    Stream the expenses in `f` into trip `trip_index`, one store write per
+    batch. Bad rows are skipped; the first MAX_REPORTED_ERRORS are listed.
+    Any error once a batch is stored is raised as PartialImport.
+    """
+    added, skipped, errors = 0, 0, []
+    rows = iter_expenses(f, fmt)
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, batch_size))
+            if not chunk:
+                break
+            batch = []
+            for row_number, result in chunk:
+                if isinstance(result, dict):
+                    batch.append(result)
+                    continue
+                skipped += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": row_number, "error": result})
+            if batch:
+                store.add_expenses(trip_index, batch)
+                added += len(batch)
+    except Exception as e:
+        if added:
+            raise PartialImport(added, skipped, errors) from e
+        raise
+    return {"added": added, "skipped": skipped, "errors": errors}
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        sys.exit("usage: python trip_import.py FILE.xlsx|FILE.csv TRIP_INDEX [trip_data.json]")
+    from trip_store import create_store
+
+    store = create_store(sys.argv[3] if len(sys.argv) == 4 else "trip_data.json").open()
+    try:
+        with open(sys.argv[1], "rb") as f:
+            result = import_expenses(store, int(sys.argv[2]), f)
+    finally:
+        store.close()
+    print(f"Imported {result['added']} expenses, skipped {result['skipped']}")
+    for error in result["errors"]:
+        print(f"  row {error['row']}: {error['error']}")
@@ -0,0 +1,78 @@
+# -----------------------------
+# trip_json.py
+# -----------------------------
+# Trip data as JSON, through orjson.
+#
+# orjson encodes straight to UTF-8 bytes and is several times faster
+# than the json module in both directions. The store writes its log
+# lines and snapshots with dumps(), compact by default; TRIP_JSON_PRETTY=1
+# indents snapshots for people who read trip_data.json by hand (log
+# lines stay one per record). main.py encodes trip responses with the
+# same dumps() and keeps the encoded body of each unchanged collection
+# in a RenderedBodies cache, keyed on its version (trip_versions.py), so
+# a repeated GET of a large trip list is a memory copy, not an encode.
+import os
+import threading
+from collections import OrderedDict
+
+import orjson
+
+PRETTY = os.getenv("TRIP_JSON_PRETTY", "0") == "1"
+RENDER_CACHE_KEYS = int(os.getenv("TRIP_RENDER_CACHE_KEYS", "32"))
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(obj, pretty=False):
+    """
+    `obj` as UTF-8 JSON bytes; compact unless `pretty` (2-space indent).
+    """
+    return orjson.dumps(obj, option=_OPTIONS | orjson.OPT_INDENT_2 if pretty else _OPTIONS)
+
+
+# Raises orjson.JSONDecodeError, a subclass of json.JSONDecodeError.
+loads = orjson.loads
+
+
+class RenderedBodies:
+    """
+    The encoded body of each cached resource at one version. A newer
+    version replaces the old body, so memory stays at one copy per key;
+    the least recently used keys go beyond `max_keys`.
+    """
+
+    def __init__(self, max_keys=RENDER_CACHE_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, body)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, body):
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] > version:
+                return  # a slower render of an older version finished last
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._entries),
+                "bytes": sum(len(body) for _, body in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
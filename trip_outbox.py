@@ -0,0 +1,266 @@
+# -----------------------------
+# trip_outbox.py
+# -----------------------------
+# Durable queue for the Streamlit pages' writes while the server is down.
+#
+# An offline page no longer edits trip_data.json (main.py owns that file):
+# it appends the mutation to a SQLite outbox, one INSERT, under the
+# idempotency key its first attempt went out with (trip_client.write()).
+# OutboxFlusher replays the outbox oldest first, up to OUTBOX_BATCH
+# entries per round, sending each key as an Idempotency-Key header so
+# the server applies an entry once even if a reply was lost and the
+# entry is sent again. While the server stays unreachable the
+# flusher backs off exponentially (with jitter); entries the server
+# rejects outright (4xx) move to a "failed" table instead of blocking
+# the queue. Until they are sent, pending entries are overlaid on the
+# trips the page shows.
+#
+# Entries name their trip by id where it has one (offline trips get a
+# client-minted ULID), else by index:
+#   add_trip         body = the trip, with its id
+#   update_trip      body = the changed fields
+#   add_expense      body = the expense, with its id
+#   delete_expenses  body = {"ids": [...]}
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+
+from trip_ids import new_id
+
+OUTBOX_FILE = os.getenv("TRIP_OUTBOX_FILE", "trip_outbox.db")
+OUTBOX_BATCH = int(os.getenv("TRIP_OUTBOX_BATCH", "50"))
+RETRY_BASE = 1.0
+RETRY_MAX = 60.0
+IDLE_POLL = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    op TEXT NOT NULL,
+    trip TEXT,
+    body TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS failed (
+    seq INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    op TEXT NOT NULL,
+    trip TEXT,
+    body TEXT NOT NULL,
+    created REAL NOT NULL,
+    status INTEGER,
+    error TEXT
+);
+"""
+
+
+def request_for(op, trip, body):
+    """
+    (method, path, json body) that applies an outbox entry on the server.
+    """
+    base = f"/trips/{trip}" if isinstance(trip, str) else f"/trip_data/{trip}"
+    if op == "add_trip":
+        return "POST", "/trip_data", body
+    if op == "update_trip":
+        return "PATCH", base, body
+    if op == "add_expense":
+        return "POST", base + ("/expenses" if isinstance(trip, str) else "/expense"), body
+    if op == "delete_expenses":
+        return "POST", base + "/expenses:delete", body
+    raise ValueError(f"Unknown outbox op: {op}")
+
+
+def retryable(status):
+    """
+    Whether an error status means "try again later" rather than "no".
+    """
+    return status >= 500 or status in (408, 429)
+
+
+def _find_trip(trips, trip):
+    if isinstance(trip, str):
+        return next((i for i, t in enumerate(trips) if t.get("id") == trip), None)
+    return trip if trip is not None and 0 <= trip < len(trips) else None
+
+
+class Outbox:
+    def __init__(self, path=OUTBOX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.executescript(SCHEMA)
+        self.changed = threading.Event()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # ---- queue ----
+    def enqueue(self, op, trip, body, key=None):
+        """
+        Record one mutation; returns its idempotency key (`key`, if the
+        caller already sent the mutation under one, else a new one).
+        """
+        request_for(op, trip, body)  # reject unknown ops before storing
+        key = key or new_id()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO outbox (key, op, trip, body, created) VALUES (?, ?, ?, ?, ?)",
+                (key, op, json.dumps(trip), json.dumps(body, ensure_ascii=False), time.time()),
+            )
+        self.changed.set()
+        return key
+
+    def pending(self, limit=None):
+        """
+        Waiting entries, oldest first: dicts with seq, key, op, trip, body, attempts.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, key, op, trip, body, attempts, last_error FROM outbox ORDER BY seq LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [
+            {"seq": seq, "key": key, "op": op, "trip": json.loads(trip), "body": json.loads(body),
+             "attempts": attempts, "last_error": error}
+            for seq, key, op, trip, body, attempts, error in rows
+        ]
+
+    def done(self, seq):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+
+    def retry_later(self, seq, error):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE seq = ?", (error, seq),
+            )
+
+    def fail(self, seq, status, error):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO failed (seq, key, op, trip, body, created, status, error)"
+                " SELECT seq, key, op, trip, body, created, ?, ? FROM outbox WHERE seq = ?",
+                (status, error, seq),
+            )
+            self._db.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+
+    def stats(self):
+        with self._lock:
+            (pending,) = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()
+            (failed,) = self._db.execute("SELECT COUNT(*) FROM failed").fetchone()
+        return {"pending": pending, "failed": failed}
+
+    # ---- view ----
+    def overlay(self, trips):
+        """
+        `trips` with the pending entries applied, for display while they
+        wait. Only the trips an entry touches are copied.
+        """
+        entries = self.pending()
+        if not entries:
+            return trips
+        trips = list(trips)
+        for entry in entries:
+            op, body = entry["op"], entry["body"]
+            if op == "add_trip":
+                trips.append(dict(body, expenses=list(body.get("expenses", []))))
+                continue
+            i = _find_trip(trips, entry["trip"])
+            if i is None:
+                continue
+            trip = dict(trips[i], expenses=list(trips[i].get("expenses", [])))
+            if op == "update_trip":
+                trip.update(body)
+            elif op == "add_expense":
+                trip["expenses"].append(body)
+            elif op == "delete_expenses":
+                ids = set(body["ids"])
+                trip["expenses"] = [e for e in trip["expenses"] if e.get("id") not in ids]
+            trips[i] = trip
+        return trips
+
+
+class OutboxFlusher:
+    """
+    Background thread replaying an Outbox to the API at `fastapi_url`.
+    """
+
+    def __init__(self, outbox, fastapi_url, session=None, batch=OUTBOX_BATCH):
+        self.outbox = outbox
+        self.fastapi_url = fastapi_url
+        self.session = session or requests.Session()
+        self.batch = batch
+        self.failures = 0  # consecutive rounds that hit an unreachable server
+        self.sent = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="trip-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.outbox.changed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.outbox.changed.clear()
+            if self.flush():
+                continue  # a full batch went out; there may be more
+            if self.failures:
+                delay = min(RETRY_MAX, RETRY_BASE * 2 ** (self.failures - 1))
+                self._stop.wait(delay * random.uniform(0.5, 1.5))
+            else:
+                self.outbox.changed.wait(IDLE_POLL)
+
+    def flush(self):
+        """
+        Send up to one batch of entries, in order. Returns True if the whole
+        batch was handled, False if the outbox ran dry or the server could
+        not be reached (the entry stays queued for the next round).
+        """
+        entries = self.outbox.pending(self.batch)
+        for entry in entries:
+            method, path, body = request_for(entry["op"], entry["trip"], entry["body"])
+            try:
+                res = self.session.request(
+                    method, f"{self.fastapi_url}{path}", json=body,
+                    headers={"Idempotency-Key": entry["key"]}, timeout=10,
+                )
+            except requests.RequestException as e:
+                self._unreachable(entry, str(e))
+                return False
+            if res.ok or (res.status_code == 409 and entry["op"] in ("add_trip", "add_expense")):
+                # 409: that id already exists, i.e. an earlier send got through.
+                self.outbox.done(entry["seq"])
+                self.sent += 1
+            elif retryable(res.status_code):
+                self._unreachable(entry, f"HTTP {res.status_code}")
+                return False
+            else:
+                self.outbox.fail(entry["seq"], res.status_code, res.text[:500])
+        self.failures = 0
+        return len(entries) == self.batch
+
+    def _unreachable(self, entry, error):
+        self.outbox.retry_later(entry["seq"], error)
+        self.failures += 1
+
+    def stats(self):
+        return dict(self.outbox.stats(), sent=self.sent, failures=self.failures)
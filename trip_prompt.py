@@ -0,0 +1,110 @@
+# -----------------------------
+# trip_prompt.py
+# -----------------------------
+# Builds the AI itinerary prompt from aggregated trip spending instead of
+# the raw expense list, so prompt size no longer grows with the number of
+# expenses. The result is capped at PROMPT_MAX_TOKENS (estimated at ~4
+# characters per token): the per-day and per-category breakdowns are
+# shortened first, then the user's extra instructions are cut.
+#
+# "Spent" is in the trip's base currency. With the budget monitor's
+# status (trip_alerts.py) every expense counts, converted at its date;
+# without it only expenses already in the base currency do, and the
+# prompt names the ones left out.
+import os
+
+from trip_currency import DEFAULT_ISO, to_iso
+from trip_summary import summarize_expenses
+
+PROMPT_MAX_TOKENS = int(os.getenv("AI_PROMPT_MAX_TOKENS", "600"))
+MIN_ITEMS = 3
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def _fmt(amount):
+    return f"{amount:,.2f}"
+
+
+def _section(title, items, limit, show_currency, rest_label):
+    """
+    One "Title: a 1.00; b 2.00" line holding at most `limit` items; the
+    remainder is folded into a single "+N more" entry.
+    """
+    if not items:
+        return None
+    shown, rest = items[:limit], items[limit:]
+    parts = [f"{label} {_fmt(amount)}" + (f" {currency}" if show_currency else "") for (label, currency), amount in shown]
+    if rest:
+        rest_totals = {}
+        for (_, currency), amount in rest:
+            rest_totals[currency] = rest_totals.get(currency, 0.0) + amount
+        parts.append(
+            f"+{len(rest)} more {rest_label} "
+            + ", ".join(_fmt(a) + (f" {c}" if show_currency else "") for c, a in rest_totals.items())
+        )
+    return f"{title}: " + "; ".join(parts)
+
+
+def _budget_line(trip, budget, summary, status):
+    if status is not None:
+        base, spent = status["currency"], status["spent"]
+        left_out = {u["currency"]: u["amount"] for u in status["unconverted"]}
+    else:
+        base = to_iso(trip.get("base_currency") or DEFAULT_ISO)
+        spent, left_out = 0.0, {}
+        for currency, amount in summary["by_currency"].items():
+            if to_iso(currency) == base:
+                spent += amount
+            elif amount:
+                left_out[currency] = amount
+    line = f"Budget: {_fmt(budget)} {base}; spent {_fmt(spent)} {base}; remaining {_fmt(budget - spent)} {base}."
+    if left_out:
+        line += " Not counted in spent: " + ", ".join(f"{_fmt(a)} {c}" for c, a in left_out.items()) + "."
+    return line
+
+
+def build_trip_prompt(trip, extra="", max_tokens=PROMPT_MAX_TOKENS, summary=None, status=None):
+    """
+    `summary` is a SpendSummary snapshot; when the server already keeps
+    one for the trip, the expense list is not scanned again. `status` is
+    the trip's BudgetMonitor.status(), for a spent total across currencies.
+    """
+    if summary is None:
+        summary = summarize_expenses(trip.get("expenses", []))
+    show_currency = len(summary["by_currency"]) > 1
+
+    head = [f"Plan a trip to {trip.get('destination', '')} from {trip.get('start_date', '')} to {trip.get('end_date', '')}."]
+    budget = trip.get("budget")
+    if budget is not None:
+        head.append(_budget_line(trip, budget, summary, status))
+    if summary["count"]:
+        head.append(f"Spending so far ({summary['count']} expenses):")
+        head.append("By currency: " + "; ".join(f"{c} {_fmt(a)}" for c, a in summary["by_currency"].items()))
+    tail = "Suggest activities within the remaining budget."
+
+    # Biggest categories first; most recent days first.
+    categories = sorted(summary["by_category"].items(), key=lambda kv: -kv[1])
+    days = sorted(summary["by_day"].items(), key=lambda kv: kv[0], reverse=True)
+    extra = (extra or "").strip()
+
+    def render(limit, extra):
+        body = [
+            _section("By category", categories, limit, show_currency, "categories"),
+            _section("By day (latest first)", days, limit, show_currency, "earlier days"),
+        ]
+        return "\n".join(head + [line for line in body if line] + ([extra] if extra else []) + [tail])
+
+    limit = max(len(categories), len(days), MIN_ITEMS)
+    prompt = render(limit, extra)
+    while estimate_tokens(prompt) > max_tokens and limit > MIN_ITEMS:
+        limit = max(MIN_ITEMS, limit // 2)
+        prompt = render(limit, extra)
+
+    overflow = (estimate_tokens(prompt) - max_tokens) * 4
+    if overflow > 0 and extra:
+        cut = extra[: max(0, len(extra) - overflow)].rstrip()
+        prompt = render(limit, cut + " …" if cut else "")
+    return prompt
@@ -0,0 +1,455 @@
+# -----------------------------
+# trip_sqlite.py
+# -----------------------------
+# SQLite implementation of the trip store (TRIP_STORAGE=sqlite).
+#
+# Trips and expenses live in two tables with indexes on trip, date and
+# category, so filtered expense queries do not scan the whole dataset.
+# Fields outside the fixed columns (budget, currency, ...) round-trip
+# through a JSON `extra` column.
+#
+# One-shot migration from the JSON store:
+#   python trip_sqlite.py migrate [trip_data.json] [trip_data.db]
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+from trip_ids import new_id, with_id
+from trip_store import (
+    TripNotFound, ExpenseNotFound, DuplicateId, first_duplicate, read_store, with_ids,
+)
+
+DB_PATH = os.getenv("TRIP_DB_PATH", "trip_data.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    id          INTEGER PRIMARY KEY,
+    uid         TEXT,
+    destination TEXT NOT NULL,
+    start_date  TEXT NOT NULL,
+    end_date    TEXT NOT NULL,
+    extra       TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS expenses (
+    id          INTEGER PRIMARY KEY,
+    trip_id     INTEGER NOT NULL REFERENCES trips(id),
+    uid         TEXT,
+    date        TEXT NOT NULL,
+    category    TEXT NOT NULL,
+    amount      REAL NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    extra       TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_trip_date ON expenses(trip_id, date);
+CREATE INDEX IF NOT EXISTS idx_expenses_trip_category_date ON expenses(trip_id, category, date);
+"""
+
+# Created after older databases get their uid columns (see _upgrade).
+UID_INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_trips_uid ON trips(uid);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_expenses_uid ON expenses(uid);
+"""
+
+TRIP_SELECT = "SELECT id, uid, destination, start_date, end_date, extra FROM trips"
+EXPENSE_FIELDS = "uid, date, category, amount, description, extra"
+TRIP_INSERT = "INSERT INTO trips (uid, destination, start_date, end_date, extra) VALUES (?, ?, ?, ?, ?)"
+EXPENSE_INSERT = (
+    "INSERT INTO expenses (trip_id, uid, date, category, amount, description, extra) VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+TRIP_COLUMNS = ("id", "destination", "start_date", "end_date")
+EXPENSE_COLUMNS = ("id", "date", "category", "amount", "description")
+
+
+# -----------------------------
+# Row <-> dict
+# -----------------------------
+def _split(record, columns, skip=()):
+    extra = {k: v for k, v in record.items() if k not in columns and k not in skip}
+    return json.dumps(extra, ensure_ascii=False)
+
+
+def _trip_params(trip):
+    return (
+        trip["id"],
+        trip.get("destination", ""),
+        trip.get("start_date", ""),
+        trip.get("end_date", ""),
+        _split(trip, TRIP_COLUMNS, skip=("expenses",)),
+    )
+
+
+def _expense_params(trip_id, expense):
+    return (
+        trip_id,
+        expense["id"],
+        expense.get("date", ""),
+        expense.get("category", ""),
+        float(expense.get("amount", 0.0) or 0.0),
+        expense.get("description") or "",
+        _split(expense, EXPENSE_COLUMNS),
+    )
+
+
+def _trip_dict(row):
+    trip = {"id": row[1], "destination": row[2], "start_date": row[3], "end_date": row[4], "expenses": []}
+    trip.update(json.loads(row[5]))
+    return trip
+
+
+def _expense_dict(row):
+    expense = {"id": row[0], "date": row[1], "category": row[2], "amount": row[3], "description": row[4]}
+    expense.update(json.loads(row[5]))
+    return expense
+
+
+# -----------------------------
+# Store
+# -----------------------------
+class SqliteTripStore:
+    """
+    Same interface as trip_store.TripStore, backed by SQLite in WAL mode.
+
+    Each worker thread gets its own connection, so readers never wait on
+    the writer. Trip indexes used by the API map to row ids through an
+    in-memory list (trips are never deleted, so positions are stable);
+    trip and expense ULIDs live in uniquely indexed `uid` columns.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()  # guards _trip_ids, _trip_index, _uid_index, _connections
+        self._write_lock = threading.Lock()
+        self._trip_ids = []
+        self._trip_index = {}  # row id -> trip index
+        self._uid_index = {}   # trip ULID -> trip index
+        self._listeners = []
+
+    # ---- connections ----
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    # ---- lifecycle ----
+    def open(self):
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+        self._upgrade(conn)
+        with conn:
+            conn.executescript(UID_INDEXES)
+        rows = conn.execute("SELECT id, uid FROM trips ORDER BY id").fetchall()
+        with self._lock:
+            self._trip_ids = [row[0] for row in rows]
+            self._trip_index = {row[0]: i for i, row in enumerate(rows)}
+            self._uid_index = {row[1]: i for i, row in enumerate(rows)}
+        return self
+
+    @staticmethod
+    def _upgrade(conn):
+        # Databases created before trips/expenses had ULIDs: add and fill uid.
+        with conn:
+            for table in ("trips", "expenses"):
+                columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+                if "uid" not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN uid TEXT")
+                missing = [row[0] for row in conn.execute(f"SELECT id FROM {table} WHERE uid IS NULL")]
+                conn.executemany(f"UPDATE {table} SET uid = ? WHERE id = ?", [(new_id(), i) for i in missing])
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def refresh(self):
+        return False
+
+    def subscribe(self, listener):
+        with self._write_lock:
+            self._listeners.append(listener)
+            listener.reset(self.list_trips())
+
+    def _trip_id(self, trip_index):
+        with self._lock:
+            if trip_index < 0 or trip_index >= len(self._trip_ids):
+                raise TripNotFound(trip_index)
+            return self._trip_ids[trip_index]
+
+    def trip_index_of(self, trip_id):
+        with self._lock:
+            if trip_id not in self._uid_index:
+                raise TripNotFound(trip_id)
+            return self._uid_index[trip_id]
+
+    # ---- reads ----
+    def list_trips(self):
+        conn = self._conn()
+        trips = {}
+        for row in conn.execute(f"{TRIP_SELECT} ORDER BY id"):
+            trips[row[0]] = _trip_dict(row)
+        for row in conn.execute(f"SELECT trip_id, {EXPENSE_FIELDS} FROM expenses ORDER BY trip_id, id"):
+            trip = trips.get(row[0])
+            if trip is not None:
+                trip["expenses"].append(_expense_dict(row[1:]))
+        return list(trips.values())
+
+    def get_trip(self, trip_index):
+        trip_id = self._trip_id(trip_index)
+        conn = self._conn()
+        trip = _trip_dict(conn.execute(f"{TRIP_SELECT} WHERE id = ?", (trip_id,)).fetchone())
+        trip["expenses"] = [
+            _expense_dict(r)
+            for r in conn.execute(f"SELECT {EXPENSE_FIELDS} FROM expenses WHERE trip_id = ? ORDER BY id", (trip_id,))
+        ]
+        return trip
+
+    def get_expense(self, trip_index, expense_id):
+        trip_id = self._trip_id(trip_index)
+        row = self._conn().execute(
+            f"SELECT {EXPENSE_FIELDS} FROM expenses WHERE uid = ? AND trip_id = ?", (expense_id, trip_id)
+        ).fetchone()
+        if row is None:
+            raise ExpenseNotFound(expense_id)
+        return _expense_dict(row)
+
+    def page_trips(self, cursor=0, limit=None, with_expenses=True,
+                   destination=None, date_from=None, date_to=None, category=None):
+        with self._lock:
+            ids = self._trip_ids
+            if cursor >= len(ids):
+                return [], None
+            first_id = ids[max(cursor, 0)]
+            index_of = self._trip_index
+        sql = f"{TRIP_SELECT} WHERE id >= ?"
+        params = [first_id]
+        if destination is not None:
+            sql += " AND destination LIKE ? ESCAPE '\\'"
+            escaped = destination.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        if date_from is not None:
+            sql += " AND end_date >= ?"
+            params.append(date_from)
+        if date_to is not None:
+            sql += " AND start_date <= ?"
+            params.append(date_to)
+        if category is not None:
+            sql += " AND EXISTS (SELECT 1 FROM expenses e WHERE e.trip_id = trips.id AND e.category = ?)"
+            params.append(category)
+        sql += " ORDER BY id"
+        if limit is not None:
+            # One extra row tells us where the next page starts.
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        conn = self._conn()
+        rows = conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            next_cursor = index_of[rows[limit][0]]
+            rows = rows[:limit]
+        trips = {row[0]: _trip_dict(row) for row in rows}
+        if with_expenses and trips:
+            marks = ",".join("?" * len(trips))
+            for row in conn.execute(
+                f"SELECT trip_id, {EXPENSE_FIELDS} FROM expenses WHERE trip_id IN ({marks}) ORDER BY trip_id, id",
+                list(trips),
+            ):
+                trips[row[0]]["expenses"].append(_expense_dict(row[1:]))
+        else:
+            for trip in trips.values():
+                del trip["expenses"]
+        return [(index_of[trip_id], trip) for trip_id, trip in trips.items()], next_cursor
+
+    def query_expenses(self, trip_index, category=None, date_from=None, date_to=None, limit=None, offset=0):
+        trip_id = self._trip_id(trip_index)
+        sql = f"SELECT {EXPENSE_FIELDS} FROM expenses WHERE trip_id = ?"
+        params = [trip_id]
+        if category is not None:
+            sql += " AND category = ?"
+            params.append(category)
+        if date_from is not None:
+            sql += " AND date >= ?"
+            params.append(date_from)
+        if date_to is not None:
+            sql += " AND date <= ?"
+            params.append(date_to)
+        sql += " ORDER BY id LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        return [_expense_dict(row) for row in self._conn().execute(sql, params)]
+
+    # ---- writes ----
+    # SQLite admits one writer at a time anyway; holding _write_lock across
+    # commit + notify keeps listeners seeing events in commit order.
+    def _notify(self, event):
+        for listener in self._listeners:
+            listener.apply(event)
+
+    def add_trip(self, trip):
+        trip = with_ids(trip)
+        conn = self._conn()
+        with self._write_lock:
+            try:
+                with conn:
+                    trip_id = conn.execute(TRIP_INSERT, _trip_params(trip)).lastrowid
+                    conn.executemany(EXPENSE_INSERT, [_expense_params(trip_id, e) for e in trip["expenses"]])
+            except sqlite3.IntegrityError:
+                raise DuplicateId(trip["id"])
+            with self._lock:
+                self._trip_ids.append(trip_id)
+                trip_index = len(self._trip_ids) - 1
+                self._trip_index[trip_id] = trip_index
+                self._uid_index[trip["id"]] = trip_index
+            self._notify({"op": "add_trip", "trip_index": trip_index, "trip": trip})
+            return trip_index
+
+    def update_trip(self, trip_index, fields):
+        fields = {k: v for k, v in fields.items() if k not in ("id", "expenses")}
+        trip_id = self._trip_id(trip_index)
+        conn = self._conn()
+        with self._write_lock:
+            with conn:
+                row = conn.execute(f"{TRIP_SELECT} WHERE id = ?", (trip_id,)).fetchone()
+                updated = dict(_trip_dict(row), **fields)
+                conn.execute(
+                    "UPDATE trips SET destination = ?, start_date = ?, end_date = ?, extra = ? WHERE id = ?",
+                    _trip_params(updated)[1:] + (trip_id,),
+                )
+            if self._listeners:
+                updated["expenses"] = self.get_trip(trip_index)["expenses"]
+            self._notify({"op": "update_trip", "trip_index": trip_index, "fields": fields, "trip": updated})
+        return {k: v for k, v in updated.items() if k != "expenses"}
+
+    def add_expense(self, trip_index, expense):
+        expense = with_id(expense)
+        trip_id = self._trip_id(trip_index)
+        conn = self._conn()
+        with self._write_lock:
+            try:
+                with conn:
+                    conn.execute(EXPENSE_INSERT, _expense_params(trip_id, expense))
+            except sqlite3.IntegrityError:
+                raise DuplicateId(expense["id"])
+            self._notify({"op": "add_expense", "trip_index": trip_index, "expense": expense})
+        return expense["id"]
+
+    def add_expenses(self, trip_index, expenses):
+        expenses = [with_id(e) for e in expenses]
+        ids = [e["id"] for e in expenses]
+        duplicate = first_duplicate(ids)
+        if duplicate is not None:
+            raise DuplicateId(duplicate)
+        trip_id = self._trip_id(trip_index)
+        conn = self._conn()
+        with self._write_lock:
+            try:
+                with conn:
+                    conn.executemany(EXPENSE_INSERT, [_expense_params(trip_id, e) for e in expenses])
+            except sqlite3.IntegrityError:
+                # The whole batch rolled back; name one of the ids already stored.
+                taken = conn.execute(
+                    "SELECT uid FROM expenses WHERE uid IN (SELECT value FROM json_each(?)) LIMIT 1",
+                    (json.dumps(ids),),
+                ).fetchone()
+                raise DuplicateId(taken[0] if taken else "expense id already exists")
+            self._notify({"op": "add_expenses", "trip_index": trip_index, "expenses": expenses})
+        return ids
+
+    def _delete_row(self, trip_index, where, params):
+        conn = self._conn()
+        with self._write_lock:
+            with conn:
+                # Take the write lock up front so the row we pick is still
+                # the one deleted if another process deletes too.
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(f"SELECT id, {EXPENSE_FIELDS} FROM expenses WHERE {where}", params).fetchone()
+                if row is None:
+                    return None
+                conn.execute("DELETE FROM expenses WHERE id = ?", (row[0],))
+            deleted = _expense_dict(row[1:])
+            self._notify({"op": "delete_expense", "trip_index": trip_index, "expense": deleted})
+            return deleted
+
+    def delete_expense(self, trip_index, expense_index):
+        trip_id = self._trip_id(trip_index)
+        if expense_index < 0:
+            raise ExpenseNotFound(expense_index)
+        deleted = self._delete_row(trip_index, "trip_id = ? ORDER BY id LIMIT 1 OFFSET ?", (trip_id, expense_index))
+        if deleted is None:
+            raise ExpenseNotFound(expense_index)
+        return deleted
+
+    def delete_expense_by_id(self, trip_index, expense_id):
+        trip_id = self._trip_id(trip_index)
+        deleted = self._delete_row(trip_index, "trip_id = ? AND uid = ?", (trip_id, expense_id))
+        if deleted is None:
+            raise ExpenseNotFound(expense_id)
+        return deleted
+
+    def update_expense(self, trip_index, expense_id, expense):
+        trip_id = self._trip_id(trip_index)
+        expense = dict(expense, id=expense_id)
+        conn = self._conn()
+        with self._write_lock:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    f"SELECT {EXPENSE_FIELDS} FROM expenses WHERE uid = ? AND trip_id = ?", (expense_id, trip_id)
+                ).fetchone()
+                if row is None:
+                    raise ExpenseNotFound(expense_id)
+                params = _expense_params(trip_id, expense)
+                conn.execute(
+                    "UPDATE expenses SET date = ?, category = ?, amount = ?, description = ?, extra = ? WHERE uid = ?",
+                    params[2:] + (expense_id,),
+                )
+            self._notify({
+                "op": "update_expense", "trip_index": trip_index, "old": _expense_dict(row), "expense": expense,
+            })
+        return expense
+
+
+# -----------------------------
+# Migration
+# -----------------------------
+def migrate_json(json_path="trip_data.json", db_path=DB_PATH):
+    """
+    Copy every trip (snapshot plus any pending log records) from the JSON
+    store into an empty SQLite database. Returns (trips, expenses) copied.
+    """
+    trips = read_store(json_path)
+
+    store = SqliteTripStore(db_path).open()
+    try:
+        conn = store._conn()
+        if conn.execute("SELECT 1 FROM trips LIMIT 1").fetchone():
+            raise RuntimeError(f"{db_path} already contains trips; refusing to migrate twice")
+        with conn:
+            for trip in map(with_ids, trips):
+                trip_id = conn.execute(TRIP_INSERT, _trip_params(trip)).lastrowid
+                conn.executemany(EXPENSE_INSERT, [_expense_params(trip_id, e) for e in trip["expenses"]])
+    finally:
+        store.close()
+    return len(trips), sum(len(t.get("expenses", [])) for t in trips)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        sys.exit("usage: python trip_sqlite.py migrate [trip_data.json] [trip_data.db]")
+    src = sys.argv[2] if len(sys.argv) > 2 else "trip_data.json"
+    dst = sys.argv[3] if len(sys.argv) > 3 else DB_PATH
+    n_trips, n_expenses = migrate_json(src, dst)
+    print(f"✅ Migrated {n_trips} trips and {n_expenses} expenses from {src} to {dst}")
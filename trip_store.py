@@ -0,0 +1,749 @@
+# -----------------------------
+# trip_store.py
+# -----------------------------
+# Append-only storage engine behind main.py.
+#
+# trip_data.json stays the snapshot (the Streamlit pages still read it).
+# Every mutation is appended as one JSON line to trip_data.json.log and a
+# background thread folds the log back into the snapshot, so a write costs
+# one appended line instead of a rewrite of the whole file. Both are
+# encoded with orjson (trip_json.py), compact unless TRIP_JSON_PRETTY=1.
+#
+# The trips themselves stay resident in memory: main.py loads the store
+# once at startup and every endpoint reads from it. If another process
+# rewrites trip_data.json, the next read notices the new inode/mtime and
+# reloads.
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from trip_ids import new_id, with_id
+from trip_json import PRETTY, dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Compact once this many records are pending, or COMPACT_DELAY seconds
+# after the first pending record, whichever comes first.
+COMPACT_EVERY = int(os.getenv("TRIP_LOG_COMPACT_EVERY", "1000"))
+COMPACT_DELAY = float(os.getenv("TRIP_LOG_COMPACT_DELAY", "2.0"))
+
+
+class TripNotFound(LookupError):
+    pass
+
+
+class ExpenseNotFound(LookupError):
+    pass
+
+
+class DuplicateId(ValueError):
+    pass
+
+
+# -----------------------------
+# Log records
+# -----------------------------
+def apply_record(trips, record):
+    """
+    Apply one log record to an in-memory list of trips and return the
+    index of the trip it touched.
+    """
+    op = record["op"]
+    if op == "add_trip":
+        trips.append(record["trip"])
+        return len(trips) - 1
+    if op == "update_trip":
+        trips[record["trip_index"]] = dict(trips[record["trip_index"]], **record["fields"])
+    elif op == "add_expense":
+        trips[record["trip_index"]].setdefault("expenses", []).append(record["expense"])
+    elif op == "add_expenses":
+        trips[record["trip_index"]].setdefault("expenses", []).extend(record["expenses"])
+    elif op == "update_expense":
+        trips[record["trip_index"]]["expenses"][record["expense_index"]] = record["expense"]
+    elif op == "delete_expense":
+        trips[record["trip_index"]]["expenses"].pop(record["expense_index"])
+    else:
+        raise ValueError(f"Unknown log record: {op!r}")
+    return record["trip_index"]
+
+
+def with_ids(trip):
+    """
+    `trip` with an "id" on itself and on each of its expenses.
+    """
+    trip = with_id(trip)
+    trip["expenses"] = [with_id(e) for e in trip.get("expenses", [])]
+    return trip
+
+
+def first_duplicate(ids):
+    seen = set()
+    for record_id in ids:
+        if record_id in seen:
+            return record_id
+        seen.add(record_id)
+    return None
+
+
+def backfill_ids(trips):
+    """
+    Give ids, in place, to trips and expenses stored before ids existed.
+    Returns how many were missing.
+    """
+    missing = 0
+    for records in itertools.chain([trips], (t.setdefault("expenses", []) for t in trips)):
+        for record in records:
+            if not record.get("id"):
+                record["id"] = new_id()
+                missing += 1
+    return missing
+
+
+def trip_matches(trip, destination=None, date_from=None, date_to=None, category=None):
+    """
+    Trip filter shared by the stores: destination substring (any case),
+    trip dates overlapping [date_from, date_to], and at least one expense
+    in `category`.
+    """
+    if destination is not None and destination.lower() not in trip.get("destination", "").lower():
+        return False
+    if date_from is not None and trip.get("end_date", "") < date_from:
+        return False
+    if date_to is not None and trip.get("start_date", "") > date_to:
+        return False
+    if category is not None and not any(e.get("category") == category for e in trip.get("expenses", [])):
+        return False
+    return True
+
+
+def read_snapshot(path, strict=False):
+    """
+    Load the trip list at `path`. An unreadable file counts as empty
+    unless `strict`, in which case the JSONDecodeError propagates.
+    """
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "rb") as f:
+            return loads(f.read())
+    except json.JSONDecodeError:
+        if strict:
+            raise
+        return []
+
+
+# -----------------------------
+# Durable files
+# -----------------------------
+FSYNC_LOG = os.getenv("TRIP_LOG_FSYNC", "0") == "1"
+
+
+def fsync_dir(path):
+    """
+    Make a rename/unlink inside the directory of `path` durable.
+    """
+    if os.name != "posix":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_durable(path, data):
+    """
+    Write the bytes `data` to a fresh file at `path`, then flush and fsync it.
+    """
+    with open(path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_json_atomic(path, data, pretty=PRETTY):
+    """
+    Replace `path` with `data` as JSON via temp file + fsync + rename, so
+    readers see either the old file or the new one, never a torn write.
+    Each call gets its own temp file, so concurrent writers (threads
+    included) never share one; the last rename wins.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dumps(data, pretty))
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file 0600; keep the mode readers had.
+        try:
+            os.chmod(tmp, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    fsync_dir(path)
+
+
+# -----------------------------
+# Locks
+# -----------------------------
+class TripLocks:
+    """
+    One lock per trip index, created on first use. Writers hold the lock
+    of the trip they modify, so writes to different trips never wait on
+    each other except for the single log append they share.
+    """
+
+    def __init__(self):
+        self._registry = threading.Lock()
+        self._locks = {}
+
+    def __call__(self, trip_index):
+        with self._registry:
+            lock = self._locks.get(trip_index)
+            if lock is None:
+                lock = self._locks[trip_index] = threading.Lock()
+            return lock
+
+    @contextmanager
+    def all(self, count):
+        """
+        Hold the locks of trips 0..count-1 (always in index order).
+        """
+        locks = [self(i) for i in range(count)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+
+class IdIndex:
+    """
+    Store listener mapping trip ids to trip indexes and expense ids to
+    (trip index, expense dict), so id lookups never scan the trips.
+    Expense positions are indexed per trip on first use; a delete before
+    the end shifts them, so that trip's positions are dropped and rebuilt
+    on the next lookup.
+    """
+
+    def __init__(self):
+        self.trips = {}
+        self.expenses = {}
+        self.positions = {}
+
+    def reset(self, trips):
+        self.trips = {t.get("id"): i for i, t in enumerate(trips)}
+        self.expenses = {e.get("id"): (i, e) for i, t in enumerate(trips) for e in t.get("expenses", [])}
+        self.positions = {}
+
+    def position(self, trip_index, expense_id, expenses):
+        """
+        Position of `expense_id` in `expenses`, trip `trip_index`'s list;
+        the caller holds the trip's lock.
+        """
+        positions = self.positions.get(trip_index)
+        if positions is None:
+            positions = self.positions[trip_index] = {e.get("id"): p for p, e in enumerate(expenses)}
+        return positions[expense_id]
+
+    def _append_positions(self, trip_index, expenses):
+        # Ids are unique, so the map holds one entry per expense.
+        positions = self.positions.get(trip_index)
+        if positions is not None:
+            for e in expenses:
+                positions[e["id"]] = len(positions)
+
+    def apply(self, event):
+        op = event["op"]
+        trip_index = event["trip_index"]
+        if op == "add_trip":
+            self.trips[event["trip"]["id"]] = trip_index
+            for e in event["trip"].get("expenses", []):
+                self.expenses[e["id"]] = (trip_index, e)
+        elif op == "add_expense":
+            self.expenses[event["expense"]["id"]] = (trip_index, event["expense"])
+            self._append_positions(trip_index, [event["expense"]])
+        elif op == "update_expense":
+            self.expenses[event["expense"]["id"]] = (trip_index, event["expense"])
+        elif op == "add_expenses":
+            for e in event["expenses"]:
+                self.expenses[e["id"]] = (trip_index, e)
+            self._append_positions(trip_index, event["expenses"])
+        elif op == "delete_expense":
+            self.expenses.pop(event["expense"].get("id"), None)
+            positions = self.positions.get(trip_index)
+            if positions is not None and event["expense_index"] == len(positions) - 1:
+                positions.pop(event["expense"].get("id"), None)
+            else:
+                self.positions.pop(trip_index, None)
+
+
+def replay_log(trips, path, strict=False):
+    """
+    Apply every complete record in the log at `path` to `trips`.
+
+    A torn last line (crash mid-append) is cut off so new records are
+    appended after the last good one. With `strict` the file is left as
+    it is, and a corrupt record before the last line raises ValueError
+    instead of ending the replay there.
+    """
+    if not os.path.exists(path):
+        return 0
+    applied = 0
+    good_offset = 0
+    with open(path, "rb") as f:
+        for line_number, raw in enumerate(f, 1):
+            try:
+                if not raw.endswith(b"\n"):
+                    raise ValueError("record is not terminated")
+                record = loads(raw)
+            except ValueError as e:
+                if strict and f.read(1):
+                    raise ValueError(f"{path}: corrupt record on line {line_number}: {e}") from e
+                break
+            good_offset += len(raw)
+            try:
+                apply_record(trips, record)
+                applied += 1
+            except (LookupError, ValueError) as e:
+                logger.warning("Skipping log record %r: %s", record, e)
+    if not strict and good_offset != os.path.getsize(path):
+        logger.warning("Truncating torn tail of %s at byte %d", path, good_offset)
+        with open(path, "r+b") as f:
+            f.truncate(good_offset)
+    return applied
+
+
+def read_store(path):
+    """
+    The trips a TripStore at `path` would open with, read the way its
+    recovery does (see TripStore) but without changing any file: the
+    snapshot, then .log.old and .log after an interrupted compaction.
+    A corrupt snapshot, or a corrupt log record other than a torn last
+    line, raises instead of being dropped.
+    """
+    if os.path.exists(path + ".log.old"):
+        snapshot, segments = path, [path + ".log.old", path + ".log"]
+    else:
+        compacted = path + ".compact"
+        merged = path + ".log.merge"
+        snapshot = compacted if os.path.exists(compacted) else path
+        segments = [merged if os.path.exists(merged) else path + ".log"]
+    trips = read_snapshot(snapshot, strict=True)
+    for segment in segments:
+        replay_log(trips, segment, strict=True)
+    return trips
+
+
+# -----------------------------
+# Store
+# -----------------------------
+# Every backend exposes the same methods, which is all main.py relies on:
+#   open() / close() / refresh() / subscribe(listener)
+#   list_trips() / get_trip(trip_index) / page_trips(cursor, limit, with_expenses, **filters)
+#   query_expenses(trip_index, category, date_from, date_to, limit, offset)
+#   add_trip(trip) / add_expense(trip_index, expense) / delete_expense(trip_index, expense_index)
+#   add_expenses(trip_index, expenses) / update_trip(trip_index, fields)
+#   trip_index_of(trip_id) / get_expense(trip_index, expense_id)
+#   update_expense(trip_index, expense_id, expense) / delete_expense_by_id(trip_index, expense_id)
+def create_store(path):
+    """
+    Build the store selected by TRIP_STORAGE ("json" by default, or "sqlite").
+    """
+    backend = os.getenv("TRIP_STORAGE", "json").lower()
+    if backend == "json":
+        return TripStore(path)
+    if backend == "sqlite":
+        from trip_sqlite import SqliteTripStore, DB_PATH
+        return SqliteTripStore(DB_PATH)
+    raise ValueError(f"Unknown TRIP_STORAGE backend: {backend!r}")
+
+
+class TripStore:
+    """
+    Trips held in memory, persisted as snapshot + append-only log.
+
+    Compaction protocol (crash-safe at every step):
+      1. rotate  trip_data.json.log -> trip_data.json.log.old
+      2. write   trip_data.json.compact
+      3. remove  trip_data.json.log.old      (commit point)
+      4. rename  trip_data.json.compact -> trip_data.json
+    On open, a leftover .log.old means step 3 never ran, so the old
+    snapshot plus both log segments are replayed; a leftover .compact
+    without .log.old is a committed snapshot that only needs step 4.
+    """
+
+    def __init__(self, path, compact_every=COMPACT_EVERY, compact_delay=COMPACT_DELAY):
+        self.path = path
+        self.log_path = path + ".log"
+        self.old_log_path = path + ".log.old"
+        self.compact_path = path + ".compact"
+        self.merge_path = path + ".log.merge"
+        self.compact_every = compact_every
+        self.compact_delay = compact_delay
+
+        self.trips = []
+        self._signature = None
+        self._log = None
+        self._pending = 0
+        self._lock = threading.Lock()          # guards trips, _log, _pending; held only to append + apply
+        self._trip_locks = TripLocks()         # read-modify-write of one trip
+        self._ids = IdIndex()
+        self._listeners = [self._ids]
+        self._compact_lock = threading.Lock()  # one compaction at a time
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---- lifecycle ----
+    def open(self):
+        if self._load():
+            # Persist ids given to old records right away, so they never
+            # change between restarts.
+            self.compact()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="trip-store-compactor", daemon=True)
+        self._thread.start()
+        return self
+
+    def _load(self, strict=False):
+        """
+        (Re)read snapshot + log. Returns how many ids had to be backfilled.
+        """
+        interrupted = os.path.exists(self.old_log_path)
+        if interrupted:
+            for leftover in (self.compact_path, self.merge_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        else:
+            if os.path.exists(self.compact_path):
+                os.replace(self.compact_path, self.path)
+            if os.path.exists(self.merge_path):
+                os.replace(self.merge_path, self.log_path)
+
+        with self._trip_locks.all(len(self.trips)), self._lock:
+            # Stat before reading: an edit racing the read then just
+            # triggers one more reload instead of going unnoticed.
+            signature = self._snapshot_signature()
+            trips = read_snapshot(self.path, strict=strict)
+            self._signature = signature
+            pending = replay_log(trips, self.old_log_path)
+            pending += replay_log(trips, self.log_path)
+            missing = backfill_ids(trips)
+            pending += missing
+
+            self.trips = trips
+            self._pending = pending
+            for listener in self._listeners:
+                listener.reset(trips)
+            if self._log is not None:
+                self._log.close()
+            if interrupted:
+                # Merge both segments (old first) so step 1 can run again.
+                # Removing .log.old is the commit point, same as compaction.
+                with open(self.merge_path, "wb") as dst:
+                    for segment in (self.old_log_path, self.log_path):
+                        if os.path.exists(segment):
+                            with open(segment, "rb") as src:
+                                dst.write(src.read())
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(self.old_log_path)
+                os.replace(self.merge_path, self.log_path)
+                fsync_dir(self.log_path)
+            self._log = open(self.log_path, "ab")
+            if pending:
+                self._wake.set()
+        return missing
+
+    def _snapshot_signature(self):
+        return self._signature_of(self.path)
+
+    @staticmethod
+    def _signature_of(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def refresh(self):
+        """
+        Reload if trip_data.json was rewritten by another process
+        (e.g. trip_web.py's offline fallback). Costs one stat() call.
+        Pending log records are replayed on top of the new snapshot.
+        """
+        # A compaction in progress is our own write; check next time.
+        if not self._compact_lock.acquire(blocking=False):
+            return False
+        try:
+            if self._snapshot_signature() == self._signature:
+                return False
+            logger.info("%s changed on disk, reloading", self.path)
+            try:
+                self._load(strict=True)
+            except json.JSONDecodeError:
+                # Probably caught another process mid-write; keep serving
+                # what we have and look again on the next call.
+                logger.warning("%s is not valid JSON yet, keeping cached trips", self.path)
+                return False
+            return True
+        finally:
+            self._compact_lock.release()
+
+    def close(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.compact()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def subscribe(self, listener):
+        """
+        Keep `listener` in step with the trips: listener.reset(trips) now and
+        after every reload, listener.apply(event) after every mutation. Events
+        are log records; delete events also carry the deleted "expense".
+        Events for a trip also carry its "trip_index", update_expense events
+        the replaced expense as "old" and update_trip events the updated
+        "trip". Both run under the store lock, so they must be quick.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            listener.reset(self.trips)
+
+    # ---- reads ----
+    def list_trips(self):
+        self.refresh()
+        with self._lock:
+            return list(self.trips)
+
+    def get_trip(self, trip_index):
+        self.refresh()
+        with self._trip_locks(trip_index):
+            trip = self._check_trip(trip_index)
+            return dict(trip, expenses=list(trip.get("expenses", [])))
+
+    def trip_index_of(self, trip_id):
+        self.refresh()
+        with self._lock:
+            trip_index = self._ids.trips.get(trip_id)
+        if trip_index is None:
+            raise TripNotFound(trip_id)
+        return trip_index
+
+    def get_expense(self, trip_index, expense_id):
+        self.refresh()
+        with self._trip_locks(trip_index):
+            return self._locate(trip_index, expense_id)[1]
+
+    def page_trips(self, cursor=0, limit=None, with_expenses=True, **filters):
+        """
+        Return ([(trip_index, trip), ...], next_cursor) for up to `limit`
+        trips at index >= cursor matching trip_matches(**filters).
+        next_cursor is None once the end is reached.
+        """
+        self.refresh()
+        trips = self.trips  # append-only between reloads; a reload swaps the list
+        matches = []
+        index = max(cursor, 0)
+        while index < len(trips):
+            if limit is not None and len(matches) >= limit:
+                return matches, index
+            trip = trips[index]
+            if trip_matches(trip, **filters):
+                if with_expenses:
+                    trip = dict(trip, expenses=list(trip.get("expenses", [])))
+                else:
+                    trip = {k: v for k, v in trip.items() if k != "expenses"}
+                matches.append((index, trip))
+            index += 1
+        return matches, None
+
+    def query_expenses(self, trip_index, category=None, date_from=None, date_to=None, limit=None, offset=0):
+        self.refresh()
+        with self._trip_locks(trip_index):
+            if trip_index < 0 or trip_index >= len(self.trips):
+                raise TripNotFound(trip_index)
+            expenses = list(self.trips[trip_index].get("expenses", []))
+        matches = (
+            e for e in expenses
+            if (category is None or e.get("category") == category)
+            and (date_from is None or e.get("date", "") >= date_from)
+            and (date_to is None or e.get("date", "") <= date_to)
+        )
+        stop = None if limit is None else offset + limit
+        return list(itertools.islice(matches, offset, stop))
+
+    # ---- writes ----
+    def _append(self, record, event=None, new_ids=()):
+        # Serialize outside the shared section; inside it, the log line and
+        # the in-memory change land together so compaction sees both or neither.
+        line = dumps(record) + b"\n"
+        with self._lock:
+            for kind, record_id in new_ids:
+                if record_id in getattr(self._ids, kind):
+                    raise DuplicateId(record_id)
+            self._log.write(line)
+            self._log.flush()
+            if FSYNC_LOG:
+                os.fsync(self._log.fileno())
+            trip_index = apply_record(self.trips, record)
+            self._pending += 1
+            event = dict(event or record, trip_index=trip_index)
+            for listener in self._listeners:
+                listener.apply(event)
+        self._wake.set()
+        return trip_index
+
+    def _check_trip(self, trip_index):
+        # Caller holds the trip's lock, so the answer cannot go stale.
+        if trip_index < 0 or trip_index >= len(self.trips):
+            raise TripNotFound(trip_index)
+        return self.trips[trip_index]
+
+    def _locate(self, trip_index, expense_id):
+        """
+        (position, expense) of `expense_id` in trip `trip_index`; the caller
+        holds the trip's lock. O(1) while the trip's positions are indexed;
+        the first lookup after a delete rebuilds them, which is O(n) like
+        the list.pop() that shifted them.
+        """
+        expenses = self._check_trip(trip_index).get("expenses", [])
+        found = self._ids.expenses.get(expense_id)
+        if found is None or found[0] != trip_index:
+            raise ExpenseNotFound(expense_id)
+        return self._ids.position(trip_index, expense_id, expenses), found[1]
+
+    def add_trip(self, trip):
+        self.refresh()
+        trip = with_ids(trip)
+        new_ids = [("trips", trip["id"])] + [("expenses", e["id"]) for e in trip["expenses"]]
+        # Trips are only ever appended, so no per-trip lock is needed.
+        return self._append({"op": "add_trip", "trip": trip}, new_ids=new_ids)
+
+    def update_trip(self, trip_index, fields):
+        """
+        Set top-level trip fields (budget, dates, ...); ids and expenses
+        cannot be changed this way. Returns the trip without its expenses.
+        """
+        self.refresh()
+        fields = {k: v for k, v in fields.items() if k not in ("id", "expenses")}
+        with self._trip_locks(trip_index):
+            updated = dict(self._check_trip(trip_index), **fields)
+            record = {"op": "update_trip", "trip_index": trip_index, "fields": fields}
+            self._append(record, event=dict(record, trip=updated))
+        return {k: v for k, v in updated.items() if k != "expenses"}
+
+    def add_expense(self, trip_index, expense):
+        self.refresh()
+        expense = with_id(expense)
+        with self._trip_locks(trip_index):
+            self._check_trip(trip_index)
+            self._append(
+                {"op": "add_expense", "trip_index": trip_index, "expense": expense},
+                new_ids=[("expenses", expense["id"])],
+            )
+        return expense["id"]
+
+    def add_expenses(self, trip_index, expenses):
+        """
+        Add a batch of expenses to one trip as a single log record: one
+        write, and none of the batch is stored if any id is taken.
+        Returns the expense ids.
+        """
+        self.refresh()
+        expenses = [with_id(e) for e in expenses]
+        ids = [e["id"] for e in expenses]
+        duplicate = first_duplicate(ids)
+        if duplicate is not None:
+            raise DuplicateId(duplicate)
+        with self._trip_locks(trip_index):
+            self._check_trip(trip_index)
+            self._append(
+                {"op": "add_expenses", "trip_index": trip_index, "expenses": expenses},
+                new_ids=[("expenses", i) for i in ids],
+            )
+        return ids
+
+    def update_expense(self, trip_index, expense_id, expense):
+        self.refresh()
+        expense = dict(expense, id=expense_id)
+        with self._trip_locks(trip_index):
+            position, old = self._locate(trip_index, expense_id)
+            record = {
+                "op": "update_expense", "trip_index": trip_index, "expense_index": position, "expense": expense,
+            }
+            self._append(record, event=dict(record, old=old))
+        return expense
+
+    def _delete_at(self, trip_index, expense_index, deleted):
+        record = {"op": "delete_expense", "trip_index": trip_index, "expense_index": expense_index}
+        self._append(record, event=dict(record, expense=deleted))
+        return deleted
+
+    def delete_expense(self, trip_index, expense_index):
+        self.refresh()
+        with self._trip_locks(trip_index):
+            expenses = self._check_trip(trip_index).get("expenses", [])
+            if expense_index < 0 or expense_index >= len(expenses):
+                raise ExpenseNotFound(expense_index)
+            return self._delete_at(trip_index, expense_index, expenses[expense_index])
+
+    def delete_expense_by_id(self, trip_index, expense_id):
+        self.refresh()
+        with self._trip_locks(trip_index):
+            return self._delete_at(trip_index, *self._locate(trip_index, expense_id))
+
+    # ---- compaction ----
+    def compact(self):
+        with self._compact_lock:
+            with self._lock:
+                if self._pending == 0 or self._log is None:
+                    return False
+                self._log.close()
+                os.replace(self.log_path, self.old_log_path)
+                self._log = open(self.log_path, "ab")
+                self._pending = 0
+                # Expense dicts are never mutated in place, so copying the
+                # containers is enough for a consistent snapshot.
+                snapshot = [dict(t, expenses=list(t.get("expenses", []))) for t in self.trips]
+
+            write_durable(self.compact_path, dumps(snapshot, PRETTY))
+            signature = self._signature_of(self.compact_path)
+            os.remove(self.old_log_path)
+            fsync_dir(self.old_log_path)
+            os.replace(self.compact_path, self.path)
+            fsync_dir(self.path)
+            # rename() keeps inode and mtime, so this is our own snapshot.
+            self._signature = signature
+            return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            if self._stop.is_set():
+                break
+            # Let a burst of writes settle unless the log is already long.
+            if self._pending < self.compact_every:
+                self._stop.wait(self.compact_delay)
+            self._wake.clear()
+            try:
+                self.compact()
+            except OSError:
+                logger.exception("Trip log compaction failed")
@@ -0,0 +1,131 @@
+# -----------------------------
+# trip_summary.py
+# -----------------------------
+# Per-trip spending totals by currency, category and day.
+#
+# TripSummaries subscribes to the store and adjusts the totals of one
+# trip on every expense add/update/delete, so /trip_data/{i}/summary never has
+# to rescan the expense list. Amounts are kept together with a row count
+# per key, so a key disappears exactly when its last expense is deleted.
+import threading
+
+DEFAULT_CURRENCY = "THB (฿)"
+
+
+def expense_keys(expense):
+    """
+    (amount, currency, category, day) with the same fallbacks the
+    Streamlit pages use for old rows that lack a field.
+    """
+    return (
+        float(expense.get("amount", 0.0) or 0.0),
+        expense.get("currency") or DEFAULT_CURRENCY,
+        expense.get("category") or "Other",
+        expense.get("date") or "unknown",
+    )
+
+
+def _bump(totals, key, amount, count):
+    total, n = totals.get(key, (0.0, 0))
+    n += count
+    if n <= 0:
+        totals.pop(key, None)
+    else:
+        totals[key] = (total + amount, n)
+
+
+class SpendSummary:
+    def __init__(self, expenses=()):
+        self.count = 0
+        self.by_currency = {}  # currency -> (amount, rows)
+        self.by_category = {}  # (category, currency) -> (amount, rows)
+        self.by_day = {}       # (day, currency) -> (amount, rows)
+        for e in expenses:
+            self.add(e)
+
+    def _change(self, expense, sign):
+        amount, currency, category, day = expense_keys(expense)
+        self.count += sign
+        _bump(self.by_currency, currency, sign * amount, sign)
+        _bump(self.by_category, (category, currency), sign * amount, sign)
+        _bump(self.by_day, (day, currency), sign * amount, sign)
+
+    def add(self, expense):
+        self._change(expense, 1)
+
+    def remove(self, expense):
+        self._change(expense, -1)
+
+    def snapshot(self):
+        """
+        Plain totals: {"count", "by_currency", "by_category", "by_day"}.
+        """
+        def amounts(totals):
+            return {k: round(v[0], 2) for k, v in totals.items()}
+
+        return {
+            "count": self.count,
+            "by_currency": amounts(self.by_currency),
+            "by_category": amounts(self.by_category),
+            "by_day": amounts(self.by_day),
+        }
+
+
+def summarize_expenses(expenses):
+    return SpendSummary(expenses).snapshot()
+
+
+def summary_json(trip_index, snapshot):
+    return {
+        "trip_index": trip_index,
+        "count": snapshot["count"],
+        "by_currency": [{"currency": c, "amount": a} for c, a in snapshot["by_currency"].items()],
+        "by_category": [
+            {"category": k, "currency": c, "amount": a} for (k, c), a in snapshot["by_category"].items()
+        ],
+        "by_day": [
+            {"date": d, "currency": c, "amount": a} for (d, c), a in sorted(snapshot["by_day"].items())
+        ],
+    }
+
+
+class TripSummaries:
+    """
+    Store listener keeping one SpendSummary per trip index.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trips = []
+
+    def reset(self, trips):
+        summaries = [SpendSummary(t.get("expenses", [])) for t in trips]
+        with self._lock:
+            self._trips = summaries
+
+    def apply(self, event):
+        with self._lock:
+            op = event["op"]
+            if op == "add_trip":
+                self._trips.append(SpendSummary(event["trip"].get("expenses", [])))
+            elif op == "add_expense":
+                self._trips[event["trip_index"]].add(event["expense"])
+            elif op == "add_expenses":
+                summary = self._trips[event["trip_index"]]
+                for e in event["expenses"]:
+                    summary.add(e)
+            elif op == "update_expense":
+                self._trips[event["trip_index"]].remove(event["old"])
+                self._trips[event["trip_index"]].add(event["expense"])
+            elif op == "delete_expense":
+                self._trips[event["trip_index"]].remove(event["expense"])
+
+    def get(self, trip_index):
+        with self._lock:
+            if trip_index < 0 or trip_index >= len(self._trips):
+                return None
+            return self._trips[trip_index].snapshot()
+
+    def all(self):
+        with self._lock:
+            return [s.snapshot() for s in self._trips]
@@ -4,13 +4,13 @@
 import streamlit as st
 st.set_page_config(page_title="Trip Planner", layout="wide")  # Must be first
 
-import json
-import os
 from datetime import date
 import pandas as pd
-import plotly.express as px
-import requests
-from trip_utils import apply_fancy_theme, export_to_excel, export_to_csv
+from trip_client import error_detail, http_session, last_known_trips, load_expenses, load_trips, outbox, write
+from trip_ids import with_id
+from trip_utils import apply_fancy_theme, export_to_excel, export_to_csv, iter_sse_data, pick_page, select_expenses, show_spending_summary
+from trip_prompt import build_trip_prompt
+from trip_summary import summarize_expenses, summary_json
 
 # -----------------------------
 # Apply theme
@@ -20,6 +20,7 @@ apply_fancy_theme()
 # -----------------------------
 # Constants
 # -----------------------------
+FASTAPI_URL = "http://127.0.0.1:8000"
 DATA_FILE = "trip_data.json"
 GROQ_API_KEY = st.secrets.get("GROQ", {}).get("API_KEY")
 GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"  # Correct endpoint
@@ -27,29 +28,20 @@ GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"  # Correct endpoint
 # -----------------------------
 # Helpers
 # -----------------------------
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except:
-            return []
-
-def save_data(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-def local_delete_expense(trip_index, expense_index):
-    trips = load_data()
-    if 0 <= trip_index < len(trips):
-        expenses = trips[trip_index].get("expenses", [])
-        if 0 <= expense_index < len(expenses):
-            removed = expenses.pop(expense_index)
-            trips[trip_index]["expenses"] = expenses
-            save_data(trips)
-            return removed
-    return None
+# Same data path as trip_web.py: reads come from trip_client's replica,
+# writes go to the server or, while it is down, to the outbox.
+# trip_data.json belongs to main.py and is only read here.
+def save(op, trip, body):
+    """
+    "sent" or "queued"; None (after showing why) if the server refused it.
+    """
+    res = write(FASTAPI_URL, op, trip, body)
+    if res is None:
+        return "queued"
+    if not res.ok:
+        st.error(f"The server rejected this change: {error_detail(res)}")
+        return None
+    return "sent"
 
 # -----------------------------
 # Session state
@@ -79,14 +71,17 @@ with st.sidebar.form("new_trip"):
             "expenses": [],
             "budget": budget
         }
-        trips_local = load_data()
-        trips_local.append(trip_data)
-        save_data(trips_local)
-        st.sidebar.success("Trip saved locally.")
+        saved = save("add_trip", None, with_id(trip_data))
+        if saved == "sent":
+            st.sidebar.success("Trip added on server!")
+        elif saved == "queued":
+            st.sidebar.success("Server unreachable — trip queued, it will sync automatically.")
         st.session_state.refresh = not st.session_state.refresh
 
 # --- Load trips ---
-trips = load_data()
+trips, versions = load_trips(FASTAPI_URL)
+if trips is None:
+    trips = outbox(FASTAPI_URL).overlay(last_known_trips(FASTAPI_URL, DATA_FILE))
 if trips:
     trip_index = st.selectbox(
         "Select a Trip",
@@ -94,16 +89,19 @@ if trips:
         format_func=lambda i: f"{i}. {trips[i]['destination']}"
     )
     selected_trip = trips[trip_index]
+    if versions is not None:
+        selected_trip["expenses"] = load_expenses(FASTAPI_URL, trip_index) or []
+    # Writes name the trip by id, which survives other trips' changes.
+    trip_ref = selected_trip.get("id", trip_index)
     st.subheader(f"✈️ {selected_trip['destination']} ({selected_trip['start_date']} → {selected_trip['end_date']})")
 
     # --- Trip Budget ---
     current_budget = selected_trip.get("budget", 12000.0)
     new_budget = st.number_input("Set Budget (THB)", value=current_budget, step=500.0, key="budget_input")
     if new_budget != current_budget:
-        trips[trip_index]["budget"] = new_budget
-        save_data(trips)
-        selected_trip["budget"] = new_budget
-        st.success(f"Budget updated to {new_budget:,.0f} THB")
+        if save("update_trip", trip_ref, {"budget": new_budget}):
+            selected_trip["budget"] = new_budget
+            st.success(f"Budget updated to {new_budget:,.0f} THB")
 
     # --- Add Expense ---
     with st.form("add_expense"):
@@ -121,51 +119,29 @@ if trips:
                 "currency": currency,
                 "description": description
             }
-            trips[trip_index].setdefault("expenses", []).append(expense)
-            save_data(trips)
-            st.success("Expense added!")
-            st.session_state.refresh = not st.session_state.refresh
+            if save("add_expense", trip_ref, with_id(expense)):
+                st.success("Expense added!")
+                st.session_state.refresh = not st.session_state.refresh
 
     # --- Expenses Table & Delete ---
     expenses = selected_trip.get("expenses", [])
     if expenses:
         st.write("💰 Expenses")
-        for i, e in enumerate(expenses):
-            col1, col2 = st.columns([8,1])
-            with col1:
-                st.write(f"{i+1}. {e.get('date','')} | {e.get('category','')} | "
-                          f"{e.get('amount',0.0)} {e.get('currency','THB (฿)')} | {e.get('description','')}")
-            with col2:
-                if st.button(f"Delete {i+1}", key=f"del_{i}"):
-                    local_delete_expense(trip_index, i)
-                    st.success(f"Expense {i+1} deleted")
-                    st.session_state.refresh = not st.session_state.refresh
-
-        # --- Total Expenses by Currency ---
-        totals = {}
-        for e in expenses:
-            curr = e.get("currency","THB (฿)")
-            totals[curr] = totals.get(curr, 0) + e.get("amount",0.0)
-        for curr, amt in totals.items():
-            st.write(f"**Total Spent ({curr}):** {amt:.2f}")
-
-        # --- Visual Charts ---
-        df_exp = pd.DataFrame(expenses)
-        for col in ["category","amount","currency"]:
-            if col not in df_exp.columns:
-                df_exp[col] = "Unknown" if col!="amount" else 0.0
-        fig_cat = px.bar(
-            df_exp.groupby("category", as_index=False)["amount"].sum(),
-            x="category", y="amount", color="category", title="Total Expenses by Category"
-        )
-        st.plotly_chart(fig_cat, use_container_width=True)
-
-        fig_curr = px.pie(
-            df_exp.groupby("currency", as_index=False)["amount"].sum(),
-            names="currency", values="amount", title="Expenses by Currency"
-        )
-        fig_curr.update_traces(textinfo='label+percent', hoverinfo='label+value+percent')
-        st.plotly_chart(fig_curr, use_container_width=True)
+        # One page at a time, in a single widget.
+        offset, limit = pick_page(len(expenses), key=f"expense_page_{trip_index}")
+        rows = expenses[offset:offset + limit]
+        selected = select_expenses(rows, key=f"expenses_{trip_index}_{offset}_{st.session_state.refresh}")
+        if st.button(f"🗑️ Delete {len(selected)} selected", disabled=not selected):
+            ids = [rows[i].get("id") for i in selected]
+            if not all(ids):
+                # Rows from a file the server never loaded have no ids yet.
+                st.error("These expenses can only be deleted while the server is running.")
+            elif save("delete_expenses", trip_ref, {"ids": ids}):
+                st.session_state.refresh = not st.session_state.refresh
+                st.rerun()
+
+        # --- Totals & Charts ---
+        show_spending_summary(summary_json(trip_index, summarize_expenses(expenses)))
 
         # --- Export to Excel ---
         if st.button("💾 Export Expenses to Excel"):
@@ -193,10 +169,8 @@ if st.button("🧠 Generate AI Itinerary"):
     else:
         messages = [
             {"role": "system", "content": "You are a helpful travel assistant."},
-            {"role": "user", "content": f"Plan a trip to {selected_trip['destination']} from {selected_trip['start_date']} to {selected_trip['end_date']}, considering these expenses: {selected_trip.get('expenses',[])}."},
+            {"role": "user", "content": build_trip_prompt(selected_trip, extra_prompt)},
         ]
-        if extra_prompt:
-            messages.append({"role": "user", "content": extra_prompt})
 
         payload = {
             "model": "llama-3.3-70b-versatile",  # Replace with your available model
@@ -205,16 +179,19 @@ if st.button("🧠 Generate AI Itinerary"):
         }
 
         try:
-            response = requests.post(
+            with http_session().post(
                 GROQ_URL,
                 headers={"Authorization": f"Bearer {GROQ_API_KEY}"},
-                json=payload,
-                timeout=10
-            )
-            if response.status_code == 200:
-                answer = response.json().get("choices", [{}])[0].get("message", {}).get("content", "No answer returned.")
-                st.markdown(answer)
-            else:
-                st.error(f"Groq API request failed. Status: {response.status_code}, {response.text}")
+                json={**payload, "stream": True},
+                stream=True,
+                timeout=(5, 30)
+            ) as response:
+                if response.status_code == 200:
+                    st.write_stream(
+                        chunk["choices"][0].get("delta", {}).get("content") or ""
+                        for chunk in iter_sse_data(response) if chunk.get("choices")
+                    )
+                else:
+                    st.error(f"Groq API request failed. Status: {response.status_code}, {response.text}")
         except Exception as e:
             st.error(f"AI request failed: {e}")
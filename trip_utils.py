@@ -3,7 +3,11 @@
 # -------------------------
 import streamlit as st
 import pandas as pd
+import plotly.express as px
+import requests
+import json
 import io
+from trip_client import http_session
 
 # -------------------------
 # Streamlit Custom Styles
@@ -78,3 +82,121 @@ def export_to_csv(df, filename="export.csv"):
         file_name=filename,
         mime="text/csv"
     )
+
+# -------------------------
+# Spending Summary
+# -------------------------
+def fetch_budget_status(fastapi_url, trip_index, timeout=3):
+    """
+    Budget vs. spend (all currencies converted) from
+    /trip_data/{trip_index}/budget, or None if the server is unreachable.
+    """
+    try:
+        res = http_session().get(f"{fastapi_url}/trip_data/{trip_index}/budget", timeout=timeout)
+        if res.ok:
+            return res.json()
+    except requests.RequestException:
+        pass
+    return None
+
+def show_budget_status(status):
+    """
+    Render spend against the trip budget, noting any currency left out.
+    """
+    if status["budget"] is None:
+        return
+    st.metric(
+        f"Spent of budget ({status['currency']})",
+        f"{status['spent']:,.2f} / {status['budget']:,.0f}",
+        delta=f"{status['remaining']:,.2f} left",
+        delta_color="normal" if status["remaining"] >= 0 else "inverse",
+    )
+    for row in status["unconverted"]:
+        st.caption(f"No exchange rate for {row['currency']}: {row['amount']:.2f} not included")
+
+def show_spending_summary(summary):
+    """
+    Render per-currency totals and the category/currency charts from a
+    summary payload (see trip_summary.summary_json).
+    """
+    for row in summary["by_currency"]:
+        st.write(f"**Total Spent ({row['currency']}):** {row['amount']:.2f}")
+
+    fig_cat = px.bar(
+        pd.DataFrame(summary["by_category"], columns=["category", "currency", "amount"]),
+        x="category", y="amount", color="category", title="Total Expenses by Category"
+    )
+    st.plotly_chart(fig_cat, use_container_width=True)
+
+    fig_curr = px.pie(
+        pd.DataFrame(summary["by_currency"], columns=["currency", "amount"]),
+        names="currency", values="amount", title="Expenses by Currency"
+    )
+    fig_curr.update_traces(textinfo='label+percent', hoverinfo='label+value+percent')
+    st.plotly_chart(fig_curr, use_container_width=True)
+
+# -------------------------
+# Expense Table
+# -------------------------
+EXPENSE_PAGE_SIZE = 50
+EXPENSE_COLUMNS = ["date", "category", "amount", "currency", "description"]
+
+def pick_page(total, key, page_size=EXPENSE_PAGE_SIZE):
+    """
+    Page selector for a list of `total` rows; returns the (offset, limit)
+    of the chosen page.
+    """
+    pages = max(1, -(-total // page_size))
+    if pages == 1:
+        return 0, page_size
+    # Deletes can leave the remembered page past the end.
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key=key)
+    return (page - 1) * page_size, page_size
+
+def select_expenses(rows, key):
+    """
+    Render one page of expenses as a single dataframe with multi-row
+    selection; returns the positions of the selected rows in `rows`.
+    """
+    event = st.dataframe(
+        pd.DataFrame(rows, columns=EXPENSE_COLUMNS),
+        hide_index=True,
+        use_container_width=True,
+        on_select="rerun",
+        selection_mode="multi-row",
+        key=key,
+    )
+    return event.selection.rows
+
+# -------------------------
+# AI Streaming
+# -------------------------
+def iter_sse_data(response):
+    """
+    Yield the parsed JSON of each `data:` event in a streamed requests
+    response, stopping at `data: [DONE]`.
+    """
+    response.encoding = "utf-8"
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        yield json.loads(data)
+
+def stream_ai_answer(fastapi_url, trip_index, extra="", timeout=(5, 60)):
+    """
+    Yield the itinerary for a trip from the FastAPI /ask_ai/stream endpoint
+    as it is generated, for use with st.write_stream.
+    """
+    with http_session().post(f"{fastapi_url}/ask_ai/stream", json={"trip_index": trip_index, "extra": extra},
+                             stream=True, timeout=timeout) as res:
+        res.raise_for_status()
+        for event in iter_sse_data(res):
+            if "error" in event:
+                yield f"\n\n⚠️ AI request failed: {event['error']}"
+            else:
+                yield event.get("delta", "")
@@ -0,0 +1,74 @@
+# -----------------------------
+# trip_versions.py
+# -----------------------------
+# Change counters behind the ETag / Last-Modified headers in main.py.
+#
+# TripVersions subscribes to the store like TripSummaries. Every mutation
+# bumps the collection version, and the trip it touched takes that number
+# as its own version, so both only ever grow. A reload (reset) bumps
+# everything, since the file may have changed in any way. ETags also carry
+# the server's start time: counters restart at zero with the process, and
+# a copy fetched from an earlier run must not match by accident.
+import threading
+import time
+
+
+class TripVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.epoch = format(time.time_ns() // 1000, "x")
+        self._version = 0
+        self.reset([])
+
+    # ---- listener ----
+    def reset(self, trips):
+        with self._lock:
+            self._version += 1
+            self._modified = time.time()
+            self._trips = [(self._version, self._modified)] * len(trips)
+
+    def apply(self, event):
+        with self._lock:
+            self._version += 1
+            self._modified = time.time()
+            stamp = (self._version, self._modified)
+            trip_index = event["trip_index"]
+            if trip_index == len(self._trips):
+                self._trips.append(stamp)
+            elif 0 <= trip_index < len(self._trips):
+                self._trips[trip_index] = stamp
+
+    # ---- queries ----
+    def collection(self):
+        """
+        (version, modified time) of the trip list as a whole.
+        """
+        with self._lock:
+            return self._version, self._modified
+
+    def trip(self, trip_index):
+        """
+        (version, modified time) of one trip, or None if there is no such trip.
+        """
+        with self._lock:
+            if trip_index < 0 or trip_index >= len(self._trips):
+                return None
+            return self._trips[trip_index]
+
+    def tag(self, version):
+        return f"{self.epoch}-{version}"
+
+    def etag(self, version):
+        return f'W/"{self.tag(version)}"'
+
+    def snapshot(self):
+        """
+        {"version": tag, "trips": [tag per trip]}: everything a client needs
+        to tell which of its cached copies are stale, in one small response.
+        """
+        with self._lock:
+            return {"version": self.tag(self._version), "trips": [self.tag(v) for v, _ in self._trips]}
+
+    def stats(self):
+        with self._lock:
+            return {"version": self._version, "trips": len(self._trips)}